@@ -10,3 +10,51 @@ SUPPORTED_FACILITIES = {
     "Hospitals": {"building": "hospital"},
     "Schools": {"amenity": "school"},
 }
+
+# Upper bound on travel speed (km/h) per mode of transport, used to bound
+# how far a facility can reach within a travel time
+MAX_SPEED_KPH = {"driving": 130, "walking": 7, "cycling": 35}
+
+# Mean earth radius in meters
+EARTH_RADIUS_M = 6371009
+
+# Mode of transport to osmnx network type and default speed in km/h
+NETWORK_TYPES = {
+    "driving": ("drive", 50),
+    "walking": ("walk", 4),
+    "cycling": ("bike", 15),
+}
+
+# Regular expressions of the tag values excluded per mode of transport, as in
+# the osmnx network filters, to derive each mode from a road network
+# retrieved with the osmnx network type 'all'
+NETWORK_FILTERS = {
+    "driving": {
+        "access": "private",
+        "highway": "abandoned|bridleway|bus_guideway|construction|corridor|cycleway|"
+        "elevator|escalator|footway|no|path|pedestrian|planned|platform|proposed|"
+        "raceway|razed|rest_area|service|services|steps|track",
+        "motor_vehicle": "no",
+        "motorcar": "no",
+        "service": "alley|driveway|emergency_access|parking|parking_aisle|private",
+    },
+    "walking": {
+        "access": "private",
+        "highway": "abandoned|bus_guideway|construction|cycleway|motor|no|planned|"
+        "platform|proposed|raceway|razed|rest_area|services",
+        "foot": "no",
+        "service": "private",
+        "sidewalk": "separate",
+        "sidewalk:both": "separate",
+        "sidewalk:left": "separate",
+        "sidewalk:right": "separate",
+    },
+    "cycling": {
+        "access": "private",
+        "highway": "abandoned|bus_guideway|construction|corridor|elevator|escalator|"
+        "footway|motor|no|planned|platform|proposed|raceway|razed|rest_area|"
+        "services|steps",
+        "bicycle": "no",
+        "service": "private",
+    },
+}
@@ -1,5 +1,7 @@
 import hashlib
+import heapq
 import json
+import logging
 import os
 import pickle
 import time
@@ -13,7 +15,14 @@ import osmnx as ox
 import pandana
 import pandas as pd
 import requests
+import shapely
 from shapely.geometry import LineString, MultiPolygon, Point, Polygon
+from sklearn.neighbors import BallTree
+
+from gpbp.constants import EARTH_RADIUS_M, MAX_SPEED_KPH
+from gpbp.road_network import get_length_edges
+
+logger = logging.getLogger(__name__)
 
 
 def disk_cache(cache_dir="cache"):
@@ -94,6 +103,150 @@ def _get_poly_pandana(G: pandana.Network, road_node, dist_value, distance_type):
     return nodes_gdf, edges_gdf
 
 
+def _interior_nodes(road_network: nx.MultiDiGraph) -> dict:
+    """
+    The nodes contracted by simplify_for_routing, as a dictionary of node
+    to x, y and the list of (u, v, key, index) of the edges whose 'interior'
+    attribute lists the node at index.
+    """
+    interior = {}
+    for u, v, key, nodes in road_network.edges(keys=True, data="interior"):
+        for index, (node, x, y, *_) in enumerate(nodes or []):
+            interior.setdefault(node, (x, y, []))[2].append((u, v, key, index))
+    return interior
+
+
+def _nearest_nodes(
+    road_network: nx.MultiDiGraph, X: list, Y: list, interior: dict
+) -> tuple[list, np.ndarray, np.ndarray]:
+    """
+    The nearest node to each point as ox.distance.nearest_nodes, also
+    considering the interior nodes of contracted edges, with the x and y
+    coordinates of the nodes.
+    """
+    if interior:
+        nodes = list(road_network.nodes) + list(interior)
+        x = [data["x"] for _, data in road_network.nodes(data=True)]
+        y = [data["y"] for _, data in road_network.nodes(data=True)]
+        x += [x for x, _, _ in interior.values()]
+        y += [y for _, y, _ in interior.values()]
+        tree = BallTree(np.radians(np.column_stack([y, x])), metric="haversine")
+        _, ind = tree.query(np.radians(np.column_stack([Y, X])), k=1)
+        nearest = [nodes[i] for i in ind[:, 0]]
+    else:
+        nearest = list(ox.distance.nearest_nodes(road_network, X, Y))
+        x = {node: data["x"] for node, data in road_network.nodes(data=True)}
+        y = {node: data["y"] for node, data in road_network.nodes(data=True)}
+        interior = {node: (x[node], y[node], []) for node in nearest}
+    coords = [
+        (road_network.nodes[node]["x"], road_network.nodes[node]["y"])
+        if node in road_network
+        else interior[node][:2]
+        for node in nearest
+    ]
+    return nearest, np.array([c[0] for c in coords]), np.array([c[1] for c in coords])
+
+
+def _reachable_geometries(
+    road_network: nx.MultiDiGraph,
+    center: Any,
+    dist_value: float,
+    distance_type: str,
+    interior: dict,
+) -> tuple[list[Point], list[LineString]]:
+    """
+    The nodes within dist_value of center and the edges between them, as
+    nx.ego_graph and the induced subgraph would give them on the road
+    network before simplify_for_routing: the contracted edges are split at
+    their interior nodes, and center may be one of them.
+    """
+    G = road_network
+
+    def weight(data: dict) -> float:
+        # the smallest of parallel edges, 1 if missing, as in networkx
+        return min(attr.get(distance_type, 1) for attr in data.values())
+
+    def offset(node_data: tuple) -> float:
+        if distance_type not in node_data[4]:
+            raise Exception(f"{distance_type} is not summed on contracted edges")
+        return node_data[4][distance_type]
+
+    # distance of the nodes of G, Dijkstra from center or from the ends of
+    # the contracted edges through center
+    sources = {center: 0}
+    inner = {}
+    if center not in G:
+        sources = {}
+        for u, v, key, index in interior[center][2]:
+            data = G.edges[u, v, key]
+            start = offset(data["interior"][index])
+            for node_data in data["interior"][index:]:
+                inner[node_data[0]] = min(
+                    inner.get(node_data[0], np.inf), offset(node_data) - start
+                )
+            sources[v] = min(sources.get(v, np.inf), data.get(distance_type, 1) - start)
+    heap = [(d, i, n) for i, (n, d) in enumerate(sources.items()) if d <= dist_value]
+    heapq.heapify(heap)
+    dist = {}
+    count = len(heap)
+    while heap:
+        d, _, node = heapq.heappop(heap)
+        if node in dist:
+            continue
+        dist[node] = d
+        for succ, data in G.adj[node].items():
+            d_succ = d + weight(data)
+            if succ not in dist and d_succ <= dist_value:
+                heapq.heappush(heap, (d_succ, count, succ))
+                count += 1
+
+    # the contracted edges that may hold reached interior nodes
+    contracted = {
+        (u, v, key): data
+        for node in dist
+        for u, v, key, data in list(G.out_edges(node, keys=True, data=True))
+        + list(G.in_edges(node, keys=True, data=True))
+        if data.get("interior")
+    }
+    if center not in G:
+        for u, v, key, _ in interior[center][2]:
+            contracted[u, v, key] = G.edges[u, v, key]
+    for (u, v, key), data in contracted.items():
+        if u in dist:
+            for node_data in data["interior"]:
+                d = dist[u] + offset(node_data)
+                if d > dist_value:
+                    break
+                inner[node_data[0]] = min(inner.get(node_data[0], np.inf), d)
+    inner = {node: d for node, d in inner.items() if d <= dist_value}
+
+    points = [Point(G.nodes[node]["x"], G.nodes[node]["y"]) for node in dist]
+    points += [Point(interior[node][:2]) for node in inner]
+    lines = []
+    for node in dist:
+        for _, succ, data in G.out_edges(node, data=True):
+            if succ in dist and not data.get("interior"):
+                lines.append(
+                    data.get(
+                        "geometry",
+                        LineString(
+                            [
+                                (G.nodes[node]["x"], G.nodes[node]["y"]),
+                                (G.nodes[succ]["x"], G.nodes[succ]["y"]),
+                            ]
+                        ),
+                    )
+                )
+    for (u, v, key), data in contracted.items():
+        coords = list(data["geometry"].coords)
+        path = [(u, 0)] + [(n, pos) for n, _, _, pos, _ in data["interior"]]
+        path += [(v, len(coords) - 1)]
+        for (a, start), (b, end) in zip(path[:-1], path[1:]):
+            if (a in dist or a in inner) and (b in dist or b in inner):
+                lines.append(LineString(coords[start : end + 1]))
+    return points, lines
+
+
 def calculate_isopolygons_graph(
     X: Any,
     Y: Any,
@@ -115,7 +268,8 @@ def calculate_isopolygons_graph(
     isochrone_polys = {}
     is_networkx = False
     if isinstance(G, nx.MultiDiGraph):
-        road_nodes = ox.distance.nearest_nodes(G, X, Y)
+        interior = _interior_nodes(G)
+        road_nodes, _, _ = _nearest_nodes(G, X, Y, interior)
         is_networkx = True
     elif isinstance(G, pandana.Network):
         raise Exception("Not implemented yet")
@@ -132,27 +286,10 @@ def calculate_isopolygons_graph(
         #        else:
         #            get_poly_func = _get_poly_pandana
         for road_node in road_nodes:
-            subgraph = nx.ego_graph(
-                G, road_node, radius=dist_value, distance=distance_type
-            )
-
-            node_points = [
-                Point((data["x"], data["y"]))
-                for node, data in subgraph.nodes(data=True)
-            ]
-            nodes_gdf = gpd.GeoDataFrame(
-                {"id": list(subgraph.nodes)}, geometry=node_points
+            node_points, edge_lines = _reachable_geometries(
+                G, road_node, dist_value, distance_type, interior
             )
-            nodes_gdf = nodes_gdf.set_index("id")
-
-            edge_lines = []
-            for n_fr, n_to in subgraph.edges():
-                f = nodes_gdf.loc[n_fr].geometry
-                t = nodes_gdf.loc[n_to].geometry
-                edge_lookup = G.get_edge_data(n_fr, n_to)[0].get(
-                    "geometry", LineString([f, t])
-                )
-                edge_lines.append(edge_lookup)
+            nodes_gdf = gpd.GeoDataFrame(geometry=node_points)
             edges_gdf = gpd.GeoSeries(edge_lines)
             try:
                 n = nodes_gdf.buffer(node_buff).geometry
@@ -228,6 +365,116 @@ def calculate_isopolygons_Mapbox(
     return iso_dict
 
 
+def prefilter_radius(
+    distance_type: str, dist_value: float, max_speed: float = None
+) -> float:
+    """
+    Straight-line radius in meters beyond which no household can be reached
+    within dist_value.
+
+    Parameters
+    ----------
+    distance_type : string
+        'length' (dist_value in meters) or 'travel_time' (dist_value in minutes).
+    dist_value : float
+        The distance value.
+    max_speed : float
+        Maximum travel speed in km/h, required for 'travel_time'.
+    """
+    if distance_type == "length":
+        return float(dist_value)
+    elif distance_type == "travel_time":
+        if max_speed is None:
+            raise Exception("Travel time prefilter needs a maximum speed")
+        return max_speed * 1000 / 60 * dist_value
+    raise Exception("Invalid distance type")
+
+
+def haversine_prefilter(
+    pop_gdf: pd.DataFrame, fac_gdf: pd.DataFrame, radius: Union[float, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the households within a great-circle radius of each facility using
+    a BallTree over the population coordinates.
+
+    Parameters
+    ----------
+    pop_gdf : DataFrame
+        Households with longitude and latitude columns.
+    fac_gdf : DataFrame
+        Facilities with longitude and latitude columns.
+    radius : float or array of floats
+        Search radius in meters, either shared or one per facility.
+
+    Returns
+    -------
+    fac_idx : array of ints
+        Positional index in fac_gdf of each facility-household pair.
+    pop_idx : array of ints
+        Positional index in pop_gdf of each facility-household pair.
+    dist : array of floats
+        Great-circle distance in meters of each facility-household pair.
+    """
+    if len(pop_gdf) == 0 or len(fac_gdf) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+    tree = BallTree(
+        np.radians(pop_gdf[["latitude", "longitude"]].to_numpy(dtype=float)),
+        metric="haversine",
+    )
+    ind, dist = tree.query_radius(
+        np.radians(fac_gdf[["latitude", "longitude"]].to_numpy(dtype=float)),
+        r=np.asarray(radius, dtype=float) / EARTH_RADIUS_M,
+        return_distance=True,
+    )
+    counts = np.array([len(i) for i in ind], dtype=int)
+    fac_idx = np.repeat(np.arange(len(fac_gdf)), counts)
+    pop_idx = np.concatenate(ind).astype(int)
+    dist = np.concatenate(dist) * EARTH_RADIUS_M
+    return fac_idx, pop_idx, dist
+
+
+def _max_speed(route_mode: str, road_network: Any = None) -> float:
+    """
+    Highest speed in km/h in the road network, if known, otherwise the
+    upper bound for the mode of transport.
+    """
+    if isinstance(road_network, nx.MultiDiGraph):
+        speeds = nx.get_edge_attributes(road_network, "speed_kph")
+        if speeds:
+            return max(speeds.values())
+    return MAX_SPEED_KPH.get(route_mode, max(MAX_SPEED_KPH.values()))
+
+
+def snap_distances(fac_gdf: pd.DataFrame, road_network: Any) -> np.ndarray:
+    """
+    Great-circle distance in meters from each facility to the network node
+    its isopolygon is grown from in calculate_isopolygons_graph.
+
+    Zero for every facility when road_network is not a networkx graph.
+    """
+    if not isinstance(road_network, nx.MultiDiGraph) or len(fac_gdf) == 0:
+        return np.zeros(len(fac_gdf))
+    X, Y = fac_gdf.longitude.to_list(), fac_gdf.latitude.to_list()
+    _, x, y = _nearest_nodes(road_network, X, Y, _interior_nodes(road_network))
+    return get_length_edges(X, Y, x, y, method="haversine")
+
+
+def isopolygon_margin(
+    road_network: nx.MultiDiGraph, edge_buff: float = 0.0005, node_buff: float = 0.001
+) -> float:
+    """
+    Largest straight-line distance in meters by which an isopolygon of
+    calculate_isopolygons_graph can reach beyond the network distance of its
+    farthest node: half the longest edge, as an edge is kept whole when both
+    of its ends are within reach, plus the largest buffer, in degrees.
+    """
+    longest = max(
+        (length for *_, length in road_network.edges(data="length", default=0)),
+        default=0,
+    )
+    return longest / 2 + np.radians(max(edge_buff, node_buff)) * EARTH_RADIUS_M
+
+
 def population_served(
     pop_gdf: pd.DataFrame,
     fac_gdf: gpd.GeoDataFrame,
@@ -238,50 +485,125 @@ def population_served(
     strategy: str,
     access_token: str = None,
     road_network: Any = None,
+    prefilter: bool = True,
+    max_speed: float = None,
+    prefilter_margin: float = None,
+    edge_buff: float = 0.0005,
+    node_buff: float = 0.001,
 ) -> dict:
+    """
+    Compute which households are served by each facility within each of the
+    distance_values.
+
+    When prefilter is True, households farther than the maximum reach of a
+    facility in straight-line (great-circle) distance are discarded before
+    any isopolygon is computed or tested. Facilities without any household
+    in range do not get an isopolygon at all. The maximum reach is the
+    distance value for 'length' and max_speed times the distance value for
+    'travel_time', plus prefilter_margin meters. By default the margin is
+    isopolygon_margin of the road network and of the edge_buff and
+    node_buff the isopolygons are built with for the 'osm' strategy, and
+    1000 meters for the isochrones of the 'mapbox' strategy. For the 'osm'
+    strategy the isopolygon grows from the network node nearest to the
+    facility, so the distance from the facility to that node (see
+    snap_distances) is added to its reach as well. If max_speed is not
+    given, the highest speed_kph of the road network or the upper bound for
+    the route_mode in MAX_SPEED_KPH is used.
+
+    The fraction of facility-household pairs pruned by the prefilter is
+    logged and stored in the attrs of the returned DataFrame under
+    'pruning_ratio'.
+    """
     pop_gdf = pop_gdf.copy()
-    iso_gdf = fac_gdf.copy().drop(columns="geometry")
+    iso_gdf = fac_gdf.copy().drop(columns="geometry").reset_index(drop=True)
+    if strategy == "osm" and road_network is None:
+        raise Exception("OSM strategy needs a road network")
+    if strategy not in ("mapbox", "osm"):
+        raise Exception("Invalid strategy")
+
+    pruning_ratio = 0.0
+    if prefilter:
+        if distance_type == "travel_time" and max_speed is None:
+            max_speed = _max_speed(route_mode, road_network)
+        if prefilter_margin is None and strategy == "osm":
+            prefilter_margin = isopolygon_margin(road_network, edge_buff, node_buff)
+        elif prefilter_margin is None:
+            prefilter_margin = 1000
+        reach = {
+            value: prefilter_radius(distance_type, value, max_speed) + prefilter_margin
+            for value in distance_values
+        }
+        snap = np.zeros(len(iso_gdf))
+        if strategy == "osm":
+            snap = snap_distances(iso_gdf, road_network)
+        fac_idx, pop_idx, pair_dist = haversine_prefilter(
+            pop_gdf, iso_gdf, max(reach.values()) + snap
+        )
+        nof_pairs = len(pop_gdf) * len(iso_gdf)
+        pruning_ratio = 1 - len(pop_idx) / nof_pairs if nof_pairs else 0.0
+        logger.info(
+            "Haversine prefilter kept %d of %d facility-household pairs "
+            "(%.1f%% pruned)",
+            len(pop_idx),
+            nof_pairs,
+            100 * pruning_ratio,
+        )
+        in_range = np.unique(fac_idx)
+    else:
+        in_range = np.arange(len(iso_gdf))
+
     # Get isopolygons geodataframe
-    if strategy == "mapbox":
+    dist_dict = {"ID_" + str(value): [] for value in distance_values}
+    if len(in_range) and strategy == "mapbox":
         dist_dict = calculate_isopolygons_Mapbox(
-            iso_gdf.longitude.to_list(),
-            iso_gdf.latitude.to_list(),
+            iso_gdf.longitude.iloc[in_range].to_list(),
+            iso_gdf.latitude.iloc[in_range].to_list(),
             route_mode,
             distance_type,
             distance_values,
             access_token=access_token,
         )
-        dist_df = pd.DataFrame.from_dict(dist_dict)
-        iso_gdf = pd.concat(
-            [iso_gdf.reset_index(drop=True), dist_df.reset_index(drop=True)], axis=1
-        )
-    elif strategy == "osm":
-        if road_network == None:
-            raise Exception("OSM strategy needs a road network")
+    elif len(in_range) and strategy == "osm":
         dist_dict = calculate_isopolygons_graph(
-            iso_gdf.longitude.to_list(),
-            iso_gdf.latitude.to_list(),
+            iso_gdf.longitude.iloc[in_range].to_list(),
+            iso_gdf.latitude.iloc[in_range].to_list(),
             distance_type,
             distance_values,
             road_network,
+            edge_buff=edge_buff,
+            node_buff=node_buff,
         )
-        dist_df = pd.DataFrame.from_dict(dist_dict)
-        iso_gdf = pd.concat(
-            [iso_gdf.reset_index(drop=True), dist_df.reset_index(drop=True)], axis=1
-        )
-    else:
-        raise Exception("Invalid strategy")
+    dist_df = pd.DataFrame(dist_dict, index=in_range).reindex(range(len(iso_gdf)))
+    iso_gdf = pd.concat([iso_gdf, dist_df], axis=1)
+
     serve_dict = {}
     for value in distance_values:
         column_name = "ID_" + str(value)
-        temp_iso_gdf = gpd.GeoDataFrame(
-            iso_gdf[["ID", column_name]], geometry=column_name, crs="EPSG:4326"
-        )
-        pop_gdf = pop_gdf.set_crs(temp_iso_gdf.crs)
-        temp_iso_gdf = temp_iso_gdf.dropna()
-        # Find households within isopolygons
-        serve_gdf = pop_gdf.sjoin(temp_iso_gdf, how="right", predicate="within")
-        serve_gdf = serve_gdf.dropna()
+        if prefilter:
+            # Only test the facility-household pairs within range
+            pair = pair_dist <= reach[value] + snap[fac_idx]
+            f, h = fac_idx[pair], pop_idx[pair]
+            polygons = np.asarray(gpd.GeoSeries(iso_gdf[column_name]).values)
+            points = np.asarray(pop_gdf.geometry.values)
+            within = shapely.within(points[h], polygons[f])
+            f, h = f[within], h[within]
+            serve_gdf = pd.DataFrame(
+                {
+                    "ID_left": pop_gdf["ID"].values[h],
+                    "index_left": pop_gdf.index.values[h],
+                    "ID_right": iso_gdf["ID"].values[f],
+                    "index_right": f,
+                }
+            )
+        else:
+            temp_iso_gdf = gpd.GeoDataFrame(
+                iso_gdf[["ID", column_name]], geometry=column_name, crs="EPSG:4326"
+            )
+            pop_gdf = pop_gdf.set_crs(temp_iso_gdf.crs)
+            temp_iso_gdf = temp_iso_gdf.dropna()
+            # Find households within isopolygons
+            serve_gdf = pop_gdf.sjoin(temp_iso_gdf, how="right", predicate="within")
+            serve_gdf = serve_gdf.dropna()
         if data_as_key == "population":
             serve_dict[column_name] = (
                 serve_gdf.groupby("ID_left", group_keys=True)["index_right"]
@@ -298,4 +620,5 @@ def population_served(
         lambda d: list(map(int, d)) if isinstance(d, list) else []
     )
     serve_df = serve_df.reset_index().rename(columns={"index": "Cluster_ID"})
+    serve_df.attrs["pruning_ratio"] = pruning_ratio
     return serve_df
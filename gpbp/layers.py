@@ -1,6 +1,5 @@
 from typing import List, Union
 
-import networkx as nx
 import numpy as np
 import osmnx as ox
 import pandas as pd
@@ -8,8 +7,21 @@ import pycountry
 from gadm import GADMDownloader
 from numpy.typing import NDArray
 
-from gpbp.constants import FACILITIES_SRC, POPULATION_SRC, RWI_SRC
+from gpbp.constants import (
+    FACILITIES_SRC,
+    NETWORK_FILTERS,
+    NETWORK_TYPES,
+    POPULATION_SRC,
+    RWI_SRC,
+)
 from gpbp.distance import population_served
+from gpbp.road_network import (
+    add_travel_times,
+    filter_road_network,
+    load_road_network,
+    save_road_network,
+    simplify_for_routing,
+)
 from gpbp.utils import generate_grid_in_polygon, group_population
 
 
@@ -42,6 +54,7 @@ class AdmArea:
         self.rwi_df = None
         self.iso_gdf = None
         self.road_network = None
+        self.road_networks = {}
         self._get_country_data()
 
     def _get_country_data(self) -> None:
@@ -126,7 +139,9 @@ class AdmArea:
             raise Exception("Invalid method")
         self.pop_df = POPULATION_SRC[method](self.country.alpha_3, self.geometry)
 
-    def get_road_network(self, network_type: str) -> None:
+    def get_road_network(
+        self, network_type: str, prepare_for_routing: bool = False
+    ) -> None:
         """
         Retrieve open street map road network for a network_type
         and calculate road travel time
@@ -136,34 +151,100 @@ class AdmArea:
         network_type : string
             The network type in terms of mode of transportation.
             Valid inputs : 'driving', 'walking', 'cycling'
+        prepare_for_routing : bool
+            Whether to contract chains of interstitial nodes and keep only
+            the largest strongly connected component,
+            see road_network.simplify_for_routing
         """
-        if network_type == "driving":
-            network_type = "drive"
-            default_speed = 50
-
-        elif network_type == "walking":
-            network_type = "walk"
-            default_speed = 4
-
-        elif network_type == "cycling":
-            network_type = "bike"
-            default_speed = 15
-        else:
+        if network_type not in NETWORK_TYPES:
             raise Exception("Invalid network type")
+        osmnx_network_type, default_speed = NETWORK_TYPES[network_type]
         # Get network
         self.road_network = ox.graph_from_polygon(
-            self.geometry, network_type=network_type
+            self.geometry, network_type=osmnx_network_type
         )
         # Add travel time edge attribute in minutes
-        self.road_network = ox.add_edge_speeds(
-            self.road_network, fallback=default_speed
-        )
-        self.road_network = ox.add_edge_travel_times(self.road_network)
-        time = nx.get_edge_attributes(self.road_network, "travel_time")
-        time_in_minutes = dict(
-            zip(list(time.keys()), list(map(lambda x: round(x / 60, 2), time.values())))
+        self.road_network = add_travel_times(self.road_network, default_speed)
+        if prepare_for_routing:
+            self.road_network = simplify_for_routing(self.road_network)
+
+    def get_road_networks(
+        self,
+        network_types: tuple[str, ...] = ("driving", "walking", "cycling"),
+        prepare_for_routing: bool = False,
+    ) -> None:
+        """
+        Retrieve the open street map road networks of several modes of
+        transportation with a single download and calculate road travel time.
+        The networks are stored in road_networks by mode of transportation
+        and used by prepare_optimization_data for its mode_of_transport.
+
+        The download is neither simplified nor reduced to its largest
+        component, so that each mode is filtered way by way and then
+        simplified and reduced on its own, as a download of that mode would.
+
+        Parameters
+        ----------
+        network_types : sequence of strings
+            The network types in terms of mode of transportation.
+            Valid inputs : 'driving', 'walking', 'cycling'
+        prepare_for_routing : bool
+            Whether to prepare each network for routing,
+            see road_network.simplify_for_routing
+        """
+        if any(t not in NETWORK_TYPES for t in network_types):
+            raise Exception("Invalid network type")
+        # Keep the tags needed to tell the modes apart
+        useful_tags_way = ox.settings.useful_tags_way
+        ox.settings.useful_tags_way = sorted(
+            set(useful_tags_way).union(*NETWORK_FILTERS.values())
         )
-        nx.set_edge_attributes(self.road_network, time_in_minutes, "travel_time")
+        try:
+            all_roads = ox.graph_from_polygon(
+                self.geometry, network_type="all", simplify=False, retain_all=True
+            )
+        finally:
+            ox.settings.useful_tags_way = useful_tags_way
+        for network_type in network_types:
+            road_network = filter_road_network(all_roads, network_type)
+            road_network = ox.truncate.largest_component(road_network)
+            road_network = ox.simplify_graph(road_network)
+            road_network = add_travel_times(
+                road_network, NETWORK_TYPES[network_type][1]
+            )
+            if prepare_for_routing:
+                road_network = simplify_for_routing(road_network)
+            self.road_networks[network_type] = road_network
+
+    def save_road_network(self, path: str) -> None:
+        """
+        Save the road network in a compact binary format,
+        see road_network.save_road_network
+
+        Parameters
+        ----------
+        path : string
+            Directory to save the road network to
+        """
+        if self.road_network is None:
+            raise Exception("Road network is not defined. Call get_road_network()")
+        save_road_network(self.road_network, path)
+
+    def load_road_network(self, path: str) -> None:
+        """
+        Load a road network saved with save_road_network instead of
+        retrieving it with get_road_network. The edges keep their weights,
+        geometries and the tags of NETWORK_FILTERS, so the network can still
+        be filtered by mode of transport. To share a network between
+        processes without rebuilding the graph, use
+        road_network.load_road_network with graph_type='arrays'
+
+        Parameters
+        ----------
+        path : string
+            Directory the road network was saved to
+        """
+        self.road_network = load_road_network(path)
 
     def get_rwi(self, method: str) -> None:
         """
@@ -262,6 +343,7 @@ class AdmArea:
             total_fac.drop(columns=["ID"]).reset_index().rename(columns={"index": "ID"})
         )
         cutoff_idx = int(self.fac_gdf["ID"].max()) + 1
+        road_network = self.road_networks.get(mode_of_transport, self.road_network)
         current = {}
         current[distance_type] = population_served(
             pop_gdf,
@@ -272,7 +354,7 @@ class AdmArea:
             mode_of_transport,
             strategy,
             mapbox_access_token,
-            self.road_network,
+            road_network,
         )
         potential = {}
         potential[distance_type] = population_served(
@@ -284,6 +366,6 @@ class AdmArea:
             mode_of_transport,
             strategy,
             mapbox_access_token,
-            self.road_network,
+            road_network,
         )
         return pop_count, current, potential
@@ -1,11 +1,20 @@
+import json
+import os
+
 from osmxtract import overpass
 import geopy.distance
 import pandana
 import networkx as nx
+import osmnx as ox
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-from shapely.geometry import MultiPolygon
+import shapely
+from pyproj import Geod
+from shapely.geometry import LineString, MultiPolygon
+from sklearn.neighbors import BallTree
+
+from gpbp.constants import EARTH_RADIUS_M, NETWORK_FILTERS
 
 
 def get_length_edge(x):
@@ -46,74 +55,128 @@ def get_road_geometries_overpass(
     return gdf
 
 
-def get_road_network_overpass(
-    geometry: MultiPolygon,
-    network_type: str = "driving",
+def get_length_edges(
+    from_x: np.ndarray,
+    from_y: np.ndarray,
+    to_x: np.ndarray,
+    to_y: np.ndarray,
+    method: str = "geodesic",
+) -> np.ndarray:
+    """
+    Vectorized length in meters of the straight segments between
+    (from_x, from_y) and (to_x, to_y) in longitude and latitude.
+
+    method: 'geodesic' for the distance on the WGS84 ellipsoid, identical
+    to get_length_edge, or 'haversine' for the faster great-circle distance
+    """
+    from_x, from_y, to_x, to_y = (
+        np.asarray(c, dtype=float) for c in (from_x, from_y, to_x, to_y)
+    )
+    if method == "geodesic":
+        _, _, dist = Geod(ellps="WGS84").inv(from_x, from_y, to_x, to_y)
+        return np.asarray(dist, dtype=float).reshape(from_x.shape)
+    elif method == "haversine":
+        lon1, lat1, lon2, lat2 = map(np.radians, (from_x, from_y, to_x, to_y))
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    raise Exception("Invalid length method")
+
+
+def _quantize(values: np.ndarray, rounding: int) -> np.ndarray:
+    """
+    Integer keys of values rounded to rounding decimal digits, such that
+    key / 10**rounding == round(value, rounding)
+    """
+    scaled = values * 10**rounding
+    keys = np.rint(scaled)
+    # Settle (near) ties like the builtin round, which rounds the exact decimal
+    tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    keys[tie] = np.rint(
+        [round(float(value), rounding) * 10**rounding for value in values[tie]]
+    )
+    return keys.astype(np.int64)
+
+
+def build_road_network(
+    edges: gpd.GeoDataFrame,
     road_speeds: dict = None,
     default_speed: int = None,
-    timeout: int = 2000,
     rounding: int = 5,
     graph_type: str = "networkx",
+    length_method: str = "geodesic",
 ):
     """
-    geometry: geometry of the area to get road network
-    rounding: tolerance parameter for coordinate precision"""
-    print("Building network")
-    edges = get_road_geometries_overpass(geometry, network_type, timeout)
-    edges["from_x"] = edges["geometry"].apply(lambda x: round(x.coords[0][0], rounding))
-    edges["from_y"] = edges["geometry"].apply(lambda x: round(x.coords[0][1], rounding))
-    edges["to_x"] = edges["geometry"].apply(lambda x: round(x.coords[-1][0], rounding))
-    edges["to_y"] = edges["geometry"].apply(lambda x: round(x.coords[-1][1], rounding))
-    nodes_from = edges[["from_x", "from_y"]].rename(
-        index=str, columns={"from_x": "x", "from_y": "y"}
-    )
-    nodes_to = edges[["to_x", "to_y"]].rename(
-        index=str, columns={"to_x": "x", "to_y": "y"}
-    )
-    nodes = pd.concat([nodes_from, nodes_to], axis=0)
-    nodes["xy"] = list(zip(nodes["x"], nodes["y"]))
-    nodes = pd.DataFrame(nodes["xy"].unique(), columns=["xy"])
-    nodes["x"] = nodes["xy"].apply(lambda x: x[0])
-    nodes["y"] = nodes["xy"].apply(lambda x: x[1])
-    nodes = nodes[["x", "y"]].copy()
-    nodes = nodes.reset_index()
-    nodes.columns = ["nodeID", "lon", "lat"]
-    edges_attr = pd.merge(
-        edges, nodes, left_on=["from_x", "from_y"], right_on=["lon", "lat"]
-    )
-    edges_attr = pd.merge(
-        edges_attr, nodes, left_on=["to_x", "to_y"], right_on=["lon", "lat"]
+    Build a road network from road geometries, as returned by
+    get_road_geometries_overpass, with numpy operations only.
+
+    Nodes are the end points of the road geometries, rounded to rounding
+    decimal digits and deduplicated through integer keys, numbered in
+    order of first appearance. Edge speed is the numeric maxspeed tag if
+    available, otherwise the speed for the highway type in road_speeds,
+    otherwise default_speed. Travel time is in minutes.
+
+    rounding: tolerance parameter for coordinate precision
+    length_method: 'geodesic' or 'haversine', see get_length_edges
+    graph_type: 'networkx' or 'pandana'
+    """
+    scale = 10**rounding
+    geometries = edges["geometry"].values
+    first = shapely.get_point(geometries, 0)
+    last = shapely.get_point(geometries, -1)
+    # integer-quantized coordinates, [from_x, from_y, to_x, to_y]
+    keys = _quantize(
+        np.column_stack(
+            [
+                shapely.get_x(first),
+                shapely.get_y(first),
+                shapely.get_x(last),
+                shapely.get_y(last),
+            ]
+        ),
+        rounding,
     )
-    edges_attr.rename(
-        columns={"nodeID_x": "node_start", "nodeID_y": "node_end"}, inplace=True
+
+    # Deduplicate the end points, numbering nodes in order of first appearance
+    # among all start points followed by all end points
+    points = np.concatenate([keys[:, :2], keys[:, 2:]])
+    _, first_seen, inverse = np.unique(
+        points, axis=0, return_index=True, return_inverse=True
     )
-    edges_attr["length"] = edges_attr[["from_x", "from_y", "to_x", "to_y"]].apply(
-        get_length_edge, axis=1
+    inverse = inverse.ravel()
+    order = np.argsort(first_seen)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    node_ids = rank[inverse]
+    node_xy = points[first_seen[order]] / scale
+    nodes = pd.DataFrame(
+        {"nodeID": np.arange(len(order)), "lon": node_xy[:, 0], "lat": node_xy[:, 1]}
     )
 
+    coords = keys / scale
+    edges_attr = pd.DataFrame(edges).reset_index(drop=True)
+    edges_attr["from_x"], edges_attr["from_y"] = coords[:, 0], coords[:, 1]
+    edges_attr["to_x"], edges_attr["to_y"] = coords[:, 2], coords[:, 3]
+    edges_attr["node_start"] = node_ids[: len(edges_attr)].astype(np.int_)
+    edges_attr["node_end"] = node_ids[len(edges_attr) :].astype(np.int_)
+    edges_attr["length"] = get_length_edges(
+        coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3], length_method
+    )
     edges_attr = edges_attr.reset_index()
     edges_attr["edge_key"] = 0
 
-    def apply_road_speeds(df_name, road_types_dict, road_type_col, speed_col):
-        if df_name[speed_col] is not None:
-            try:
-                speed = float(df_name[speed_col])
-            except:
-                speed = None
-            return speed
-        df_method = float(df_name[road_type_col])
-        return road_types_dict.get(df_method, None)
-
-    edges_attr["maxspeed"] = edges_attr.apply(
-        lambda row: apply_road_speeds(row, road_speeds, "highway", "maxspeed"), axis=1
-    )
-    edges_attr["maxspeed"] = edges_attr["maxspeed"].fillna(default_speed)
+    if "maxspeed" in edges_attr.columns:
+        maxspeed = pd.to_numeric(edges_attr["maxspeed"], errors="coerce")
+    else:
+        maxspeed = pd.Series(np.nan, index=edges_attr.index)
+    if road_speeds and "highway" in edges_attr.columns:
+        maxspeed = maxspeed.fillna(edges_attr["highway"].map(road_speeds))
+    edges_attr["maxspeed"] = maxspeed.fillna(default_speed).astype(float)
     edges_attr["travel_time"] = edges_attr["length"] / (
         edges_attr["maxspeed"] * 1000 / 60
     )
-    edges_attr[["node_start", "node_end"]] = edges_attr[
-        ["node_start", "node_end"]
-    ].astype(np.int_)
 
     # Road Network Data in Nodes and Edges nodes as a Pandana Network
     if graph_type == "pandana":
@@ -136,4 +199,517 @@ def get_road_network_overpass(
         network.graph["crs"] = "EPSG:4326"
         nx.set_node_attributes(network, nodes["lon"], "x")
         nx.set_node_attributes(network, nodes["lat"], "y")
+    else:
+        raise Exception("Invalid graph type")
     return network
+
+
+def get_road_network_overpass(
+    geometry: MultiPolygon,
+    network_type: str = "driving",
+    road_speeds: dict = None,
+    default_speed: int = None,
+    timeout: int = 2000,
+    rounding: int = 5,
+    graph_type: str = "networkx",
+    length_method: str = "geodesic",
+):
+    """
+    geometry: geometry of the area to get road network
+    rounding: tolerance parameter for coordinate precision
+    See build_road_network for the other parameters"""
+    print("Building network")
+    edges = get_road_geometries_overpass(geometry, network_type, timeout)
+    return build_road_network(
+        edges, road_speeds, default_speed, rounding, graph_type, length_method
+    )
+
+
+def save_road_network(
+    road_network: nx.MultiDiGraph,
+    path: str,
+    weights: list[str] = ["length", "speed_kph", "travel_time"],
+    geometry: bool = True,
+    tags: list[str] = None,
+) -> None:
+    """
+    Save a road network in a compact binary format: a directory with one
+    .npy file per array, which load_road_network can memory-map.
+
+    Nodes are stored as arrays of ids (osmid) and x, y coordinates, edges in
+    compressed sparse row (CSR) order of their source node as target node
+    positions and keys, with one float array per weight, one column of
+    integer codes per tag into its distinct values, kept in meta.json, and,
+    optionally, the edge geometries as concatenated WKB with offsets. Other
+    node and edge attributes are not saved.
+
+    Parameters
+    ----------
+    road_network : nx.MultiDiGraph
+        Road network with integer node ids and x, y node attributes.
+    path : string
+        Directory to write to, created if it does not exist.
+    weights : list of strings
+        Numeric edge attributes to save, missing values are stored as NaN.
+        Attributes that no edge has are skipped.
+    geometry : bool
+        Whether to save the edge geometries.
+    tags : list of strings
+        Edge attributes to save with their original values, by default the
+        tags of NETWORK_FILTERS and 'oneway' and 'reversed', so that a loaded
+        network can still be passed to filter_road_network, and the
+        'interior' nodes of the edges contracted by simplify_for_routing.
+        Tags that no edge has are skipped.
+    """
+    if tags is None:
+        tags = sorted(
+            {tag for filters in NETWORK_FILTERS.values() for tag in filters}
+            | {"oneway", "reversed", "interior"}
+        )
+    osmid = np.array(list(road_network.nodes))
+    if len(osmid) and not np.issubdtype(osmid.dtype, np.integer):
+        raise Exception("Only road networks with integer node ids can be saved")
+    osmid = osmid.astype(np.int64)
+    position = {node: idx for idx, node in enumerate(osmid.tolist())}
+    x = np.array([data["x"] for _, data in road_network.nodes(data=True)], dtype=float)
+    y = np.array([data["y"] for _, data in road_network.nodes(data=True)], dtype=float)
+
+    edges = list(road_network.edges(keys=True, data=True))
+    source = np.array([position[u] for u, _, _, _ in edges], dtype=np.int64)
+    order = np.argsort(source, kind="stable")
+    edges = [edges[e] for e in order]
+    arrays = {
+        "osmid": osmid,
+        "x": x,
+        "y": y,
+        "indptr": np.concatenate(
+            [[0], np.cumsum(np.bincount(source, minlength=len(osmid)))]
+        ).astype(np.int64),
+        "indices": np.array([position[v] for _, v, _, _ in edges], dtype=np.int64),
+        "key": np.array([k for _, _, k, _ in edges], dtype=np.int64),
+    }
+    saved_weights = [w for w in weights if any(w in d for _, _, _, d in edges)]
+    for w in saved_weights:
+        arrays[w] = np.array([d.get(w, np.nan) for _, _, _, d in edges], dtype=float)
+    saved_tags = [t for t in tags if any(t in d for _, _, _, d in edges)]
+    tag_values = {}
+    if saved_tags:
+        # values may be strings, booleans or lists of them, -1 if missing
+        codes = np.full((len(edges), len(saved_tags)), -1, dtype=np.int32)
+        for t, tag in enumerate(saved_tags):
+            encoded = {}
+            for e, (_, _, _, d) in enumerate(edges):
+                if tag in d:
+                    value = json.dumps(d[tag], default=str)
+                    codes[e, t] = encoded.setdefault(value, len(encoded))
+            tag_values[tag] = [json.loads(value) for value in encoded]
+        arrays["tags"] = codes
+    if geometry:
+        wkb = [
+            shapely.to_wkb(d["geometry"]) if "geometry" in d else b""
+            for _, _, _, d in edges
+        ]
+        arrays["geometry_offsets"] = np.concatenate(
+            [[0], np.cumsum([len(g) for g in wkb])]
+        ).astype(np.int64)
+        arrays["geometry_wkb"] = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    meta = {
+        "crs": str(road_network.graph.get("crs", "EPSG:4326")),
+        "weights": saved_weights,
+        "tags": saved_tags,
+        "tag_values": tag_values,
+        "geometry": geometry,
+        "nof_nodes": len(osmid),
+        "nof_edges": len(edges),
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def load_road_network_arrays(path: str, mmap: bool = True) -> dict:
+    """
+    Load the arrays of a road network saved with save_road_network.
+
+    With mmap the arrays are memory-mapped read-only, so opening is
+    independent of the size of the network and processes loading the same
+    network share its pages.
+
+    Returns
+    -------
+    dictionary
+        'meta' with the saved metadata and one array per saved file:
+        'osmid', 'x', 'y', 'indptr', 'indices', 'key', the weights and, if
+        saved, 'tags' and 'geometry_offsets' and 'geometry_wkb'. The edges
+        of node osmid[n] are at positions indptr[n] to indptr[n + 1] of the
+        edge arrays. tags[e, t] is the position of the value of tag
+        meta['tags'][t] of edge e in meta['tag_values'][meta['tags'][t]],
+        or -1 if edge e does not have the tag.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    names = ["osmid", "x", "y", "indptr", "indices", "key"] + meta["weights"]
+    if meta.get("tags"):
+        names += ["tags"]
+    if meta["geometry"]:
+        names += ["geometry_offsets", "geometry_wkb"]
+    arrays = {
+        name: np.load(
+            os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+        )
+        for name in names
+    }
+    arrays["meta"] = meta
+    return arrays
+
+
+def load_road_network(path: str, graph_type: str = "networkx", mmap: bool = True):
+    """
+    Load a road network saved with save_road_network.
+
+    Building a nx.MultiDiGraph adds the edges one by one in Python and takes
+    seconds for large networks. Callers that only need the topology,
+    coordinates and weights, e.g. several processes sharing one network,
+    should use graph_type 'arrays', which opens in well under a second
+    regardless of the size of the network.
+
+    Parameters
+    ----------
+    path : string
+        Directory the road network was saved to.
+    graph_type : string
+        'networkx' for a nx.MultiDiGraph as the one saved, 'pandana' for a
+        pandana.Network with the saved weights, or 'arrays' for the
+        (memory-mapped) arrays, see load_road_network_arrays.
+    mmap : bool
+        Whether to memory-map the arrays.
+    """
+    arrays = load_road_network_arrays(path, mmap)
+    if graph_type == "arrays":
+        return arrays
+    meta = arrays["meta"]
+    source = np.repeat(np.arange(meta["nof_nodes"]), np.diff(arrays["indptr"]))
+    if graph_type == "pandana":
+        return pandana.Network(
+            pd.Series(arrays["x"], index=arrays["osmid"]),
+            pd.Series(arrays["y"], index=arrays["osmid"]),
+            pd.Series(arrays["osmid"][source]),
+            pd.Series(arrays["osmid"][arrays["indices"]]),
+            pd.DataFrame({w: arrays[w] for w in meta["weights"]}),
+            twoway=False,
+        )
+    elif graph_type != "networkx":
+        raise Exception("Invalid graph type")
+
+    osmid = arrays["osmid"].tolist()
+    network = nx.MultiDiGraph(crs=meta["crs"])
+    network.add_nodes_from(
+        (node, {"x": x, "y": y})
+        for node, x, y in zip(osmid, arrays["x"].tolist(), arrays["y"].tolist())
+    )
+    edge_data = [{} for _ in range(meta["nof_edges"])]
+    for w in meta["weights"]:
+        for data, value in zip(edge_data, arrays[w].tolist()):
+            if not np.isnan(value):
+                data[w] = value
+    for t, tag in enumerate(meta.get("tags", [])):
+        values = meta["tag_values"][tag]
+        for data, code in zip(edge_data, arrays["tags"][:, t].tolist()):
+            if code >= 0:
+                data[tag] = values[code]
+    if meta["geometry"]:
+        offsets = arrays["geometry_offsets"]
+        wkb = arrays["geometry_wkb"]
+        has_geometry = np.flatnonzero(np.diff(offsets))
+        geometries = shapely.from_wkb(
+            [wkb[offsets[e] : offsets[e + 1]].tobytes() for e in has_geometry]
+        )
+        for e, geom in zip(has_geometry.tolist(), geometries):
+            edge_data[e]["geometry"] = geom
+    network.add_edges_from(
+        zip(
+            arrays["osmid"][source].tolist(),
+            arrays["osmid"][arrays["indices"]].tolist(),
+            arrays["key"].tolist(),
+            edge_data,
+        )
+    )
+    return network
+
+
+def _edge_geometry(road_network: nx.MultiDiGraph, u, v, data: dict) -> LineString:
+    if "geometry" in data:
+        return data["geometry"]
+    return LineString(
+        [
+            (road_network.nodes[u]["x"], road_network.nodes[u]["y"]),
+            (road_network.nodes[v]["x"], road_network.nodes[v]["y"]),
+        ]
+    )
+
+
+def _interstitial_neighbors(road_network: nx.MultiDiGraph, node) -> list:
+    """
+    The pairs (u, w) of a node that only links u to w (and w to u),
+    or an empty list if the node is an end point that must be kept.
+    """
+    preds = [u for u, _ in road_network.in_edges(node)]
+    succs = [w for _, w in road_network.out_edges(node)]
+    if node in preds or len(set(preds)) != len(preds) or len(set(succs)) != len(succs):
+        return []
+    if len(preds) == 1 and len(succs) == 1 and preds != succs:
+        return [(preds[0], succs[0])]
+    if len(preds) == 2 and set(preds) == set(succs):
+        u, w = preds
+        return [(u, w), (w, u)]
+    return []
+
+
+def _contract_degree_two(road_network: nx.MultiDiGraph, weights: list[str]) -> None:
+    """
+    Contract in place the chains of interstitial nodes, summing the weights
+    and concatenating the geometry of the merged edges. The other
+    attributes of a merged edge are those of its first edge.
+
+    The removed nodes of a merged edge are kept in order in its 'interior'
+    attribute as (node, x, y, position, offsets): the position of the node
+    in the coordinates of the geometry and the dictionary of the weights
+    from the start of the edge to the node.
+    """
+    for node in list(road_network.nodes):
+        pairs = _interstitial_neighbors(road_network, node)
+        for u, w in pairs:
+            first = next(iter(road_network.get_edge_data(u, node).values()))
+            second = next(iter(road_network.get_edge_data(node, w).values()))
+            data = dict(first)
+            interior = first.get("interior", []) + second.get("interior", [])
+            summed = [
+                wt
+                for wt in weights
+                if wt in first
+                and wt in second
+                and all(wt in offsets for *_, offsets in interior)
+            ]
+            for weight in summed:
+                data[weight] = first[weight] + second[weight]
+            coords = list(_edge_geometry(road_network, u, node, first).coords)
+            offsets = {weight: first[weight] for weight in summed}
+            data["interior"] = [
+                (n, x, y, position, {wt: off[wt] for wt in summed})
+                for n, x, y, position, off in first.get("interior", [])
+            ]
+            data["interior"].append(
+                (
+                    node,
+                    road_network.nodes[node]["x"],
+                    road_network.nodes[node]["y"],
+                    len(coords) - 1,
+                    offsets,
+                )
+            )
+            data["interior"] += [
+                (
+                    n,
+                    x,
+                    y,
+                    position + len(coords) - 1,
+                    {wt: offsets[wt] + off[wt] for wt in summed},
+                )
+                for n, x, y, position, off in second.get("interior", [])
+            ]
+            coords += list(_edge_geometry(road_network, node, w, second).coords)[1:]
+            data["geometry"] = LineString(coords)
+            road_network.add_edge(u, w, **data)
+        if pairs:
+            road_network.remove_node(node)
+
+
+def _snap_fragments(
+    road_network: nx.MultiDiGraph, main: set, weights: list[str], snap_speed: float
+) -> None:
+    """
+    Connect in place every weakly connected component disjoint from main to
+    the nearest node of main, with edges in both directions between the
+    closest pair of nodes. Components that are already linked to main are
+    left alone, so that snapping never creates shortcuts between nodes of
+    main.
+    """
+    main_nodes = list(main)
+    tree = BallTree(
+        np.radians(
+            [
+                [road_network.nodes[n]["y"], road_network.nodes[n]["x"]]
+                for n in main_nodes
+            ]
+        ),
+        metric="haversine",
+    )
+    for fragment in list(nx.weakly_connected_components(road_network)):
+        if not main.isdisjoint(fragment):
+            continue
+        fragment = list(fragment)
+        dist, ind = tree.query(
+            np.radians(
+                [
+                    [road_network.nodes[n]["y"], road_network.nodes[n]["x"]]
+                    for n in fragment
+                ]
+            )
+        )
+        closest = int(np.argmin(dist[:, 0]))
+        node, target = fragment[closest], main_nodes[ind[closest, 0]]
+        data = {"length": float(dist[closest, 0] * EARTH_RADIUS_M), "snapped": True}
+        if "travel_time" in weights:
+            data["travel_time"] = data["length"] / (snap_speed * 1000 / 60)
+        road_network.add_edge(node, target, **data)
+        road_network.add_edge(target, node, **data)
+
+
+def simplify_for_routing(
+    road_network: nx.MultiDiGraph,
+    weights: list[str] = ["length", "travel_time"],
+    fragments: str = "largest",
+    snap_speed: float = 4,
+) -> nx.MultiDiGraph:
+    """
+    Prepare a road network for routing by removing the nodes and edges
+    that do not change travel distances between the remaining nodes.
+
+    Chains of interstitial nodes, that only link two other nodes, are
+    contracted into a single edge summing the weights and merging the
+    geometry. Shortest path distances between the remaining nodes are
+    unchanged. The contracted nodes are kept in the 'interior' attribute of
+    the merged edges, from which calculate_isopolygons_graph snaps to and
+    reaches them as on the original network, so that isopolygons and the
+    households served are unchanged as well.
+
+    Parameters
+    ----------
+    road_network : nx.MultiDiGraph
+        Road network with x, y node attributes.
+    weights : list of strings
+        Edge attributes to sum along contracted chains.
+    fragments : string
+        What to do with the nodes outside the largest strongly connected
+        component: 'largest' drops them, 'snap' links every component
+        without any road to or from the largest one, in both directions, to
+        its nearest node with a straight edge (travel_time at snap_speed),
+        'keep' leaves them.
+    snap_speed : float
+        Speed in km/h on snapping edges, for a travel_time in minutes as
+        set by AdmArea.get_road_network.
+
+    Returns
+    -------
+    nx.MultiDiGraph
+        The prepared road network, a copy. The node and edge counts before
+        and after are printed and stored in its 'routing_preparation' graph
+        attribute.
+    """
+    if fragments not in ("largest", "snap", "keep"):
+        raise Exception("Invalid fragments option")
+    nof_nodes, nof_edges = len(road_network), road_network.number_of_edges()
+    network = road_network.copy()
+    if fragments != "keep" and len(network):
+        main = max(nx.strongly_connected_components(network), key=len)
+        if fragments == "largest":
+            network = network.subgraph(main).copy()
+        else:
+            _snap_fragments(network, main, weights, snap_speed)
+    _contract_degree_two(network, weights)
+    stats = {
+        "nodes_before": nof_nodes,
+        "nodes_after": len(network),
+        "edges_before": nof_edges,
+        "edges_after": network.number_of_edges(),
+    }
+    network.graph["routing_preparation"] = stats
+    print(
+        f"Routing preparation: nodes {nof_nodes} -> {stats['nodes_after']}, "
+        f"edges {nof_edges} -> {stats['edges_after']}"
+    )
+    return network
+
+
+def filter_road_network(
+    road_network: nx.MultiDiGraph, network_type: str
+) -> nx.MultiDiGraph:
+    """
+    Derive the road network of a mode of transport from a road network
+    retrieved with the osmnx network type 'all', with the tags of
+    NETWORK_FILTERS as edge attributes.
+
+    An edge is dropped if any of its tag values matches the excluded values
+    of the mode, as the osmnx network filters do on the ways. Walking
+    networks ignore one-way restrictions, as in osmnx. Filter the network
+    before ox.simplify_graph: a simplified edge merging ways open and
+    closed to the mode has a list of tag values and is dropped as a whole.
+
+    Parameters
+    ----------
+    road_network : nx.MultiDiGraph
+        Road network of all modes of transport.
+    network_type : string
+        'driving', 'walking' or 'cycling'.
+
+    Returns
+    -------
+    nx.MultiDiGraph
+        A copy with only the edges open to the mode and their nodes.
+    """
+    if network_type not in NETWORK_FILTERS:
+        raise Exception("Invalid network type")
+    edges = list(road_network.edges(keys=True, data=True))
+    index = pd.MultiIndex.from_tuples([edge[:3] for edge in edges])
+    excluded = pd.Series(False, index=index)
+    for tag, values in NETWORK_FILTERS[network_type].items():
+        # simplified edges may have a list of values per tag
+        tags = pd.Series([data.get(tag) for *_, data in edges], index=index)
+        tags = tags.explode().dropna().astype(str)
+        if len(tags):
+            match = tags.str.contains(values, regex=True)
+            excluded |= (
+                match.groupby(level=[0, 1, 2]).any().reindex(index, fill_value=False)
+            )
+    network = road_network.edge_subgraph(index[~excluded.values]).copy()
+
+    if network_type == "walking":
+        oneway = [
+            (u, v, data)
+            for u, v, data in network.edges(data=True)
+            if data.get("oneway", False) is True
+        ]
+        for u, v, data in oneway:
+            data["oneway"] = False
+            reverse = dict(data, reversed=not data.get("reversed", False))
+            if "geometry" in data:
+                reverse["geometry"] = data["geometry"].reverse()
+            network.add_edge(v, u, **reverse)
+    return network
+
+
+def add_travel_times(
+    road_network: nx.MultiDiGraph, default_speed: float
+) -> nx.MultiDiGraph:
+    """
+    Add the speed_kph and travel_time edge attributes, with travel time in
+    minutes rounded to two decimals. Speeds are imputed by osmnx, with
+    default_speed in km/h where no speed can be imputed.
+    """
+    road_network = ox.add_edge_speeds(road_network, fallback=default_speed)
+    road_network = ox.add_edge_travel_times(road_network)
+    if road_network.number_of_edges():
+        edges, seconds = zip(
+            *(
+                ((u, v, k), time)
+                for u, v, k, time in road_network.edges(keys=True, data="travel_time")
+            )
+        )
+        minutes = np.round(np.array(seconds) / 60, 2)
+        nx.set_edge_attributes(
+            road_network, dict(zip(edges, minutes.tolist())), "travel_time"
+        )
+    return road_network
@@ -1,4 +1,5 @@
 import sys
+from time import perf_counter as pc
 sys.path.insert(0, "..")
 sys.path.insert(0, "../optimization")
 
@@ -318,7 +319,9 @@ with tab4:
                               )
         opt_ready = st.button("Start optimization", key="opt_ready")
         if opt_ready:
+            timings = []
             with st.spinner(text="Preparing data for optimization..."):
+                start = pc()
                 (
                     pop_count,
                     current,
@@ -336,6 +339,7 @@ with tab4:
                     mapbox_access_token=st.session_state.mapbox_access,
                     population_resolution=st.session_state.population_resolution,
                 )
+                timings.append(dict(phase="Preparing data", distance="", seconds=pc()-start))
             
             assert set(current.keys()) == set(potential.keys())
             
@@ -350,16 +354,21 @@ with tab4:
                     assert len(set(facs.index)) == len(facs.index)
                     mappings = facs.to_dict()
                     for col in facs.columns:
-                        IJ = mappings[col]
-                        I = np.unique(np.concatenate(list(IJ.values())).astype(int))
-                        J = np.unique(list(IJ.keys()))
-                        # Transpose IJ
-                        IJ = {i: [j for j in J if i in IJ[j]] for i in I}
+                        start = pc()
+                        # households reached per facility, transposed in linear time
+                        I, J, IJ, _ = od.CreateIndexMapping(mappings[col], pop_count)
+                        timings.append(dict(phase="Index mapping", distance=col, seconds=pc()-start))
                         results[key][col] = mc.OptimizeWithPyomo( 
                             pop_count, I, J, IJ,  
                             already_open = already_open,
                             budget_list = range(int(st.session_state.budget)), solver = solver 
                         )
+                        for phase in ["modeling", "solving"]:
+                            timings.append(dict(
+                                phase=phase.capitalize(), 
+                                distance=col, 
+                                seconds=sum(r[phase] for r in results[key][col].values())
+                            ))
 
             pdf = pd.DataFrame()
             pdf.index.name = "budget"
@@ -376,7 +385,8 @@ with tab4:
                 "sdf": sdf,
                 "pop_count": pop_count,
                 "current": current,
-                "potential": potential
+                "potential": potential,
+                "timings": pd.DataFrame(timings),
             }
 
         if "results" in st.session_state:
@@ -389,6 +399,9 @@ with tab4:
             current = results["current"]
             potential = results["potential"]
 
+            with st.expander("Time per phase"):
+                st.dataframe(results["timings"], hide_index=True)
+
             fig = px.line(pdf, title='Budget vs Population Covered')
             fig.update_layout(
                 yaxis_title="population covered",
@@ -1,9 +1,18 @@
 from time import perf_counter as pc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import functools
+import multiprocessing
+import os
 import numpy as np
 import pandas as pd
 import gurobipy as gb
 import pyomo.environ as pyo
 
+# own modules
+import optdata as od
+import maxcovering as mc
+
 
 def GetPyomoSolver(solverName, timeLimit=None, mipGap=None, solver_path=None):
     if solver_path:
@@ -153,33 +162,9 @@ def OpenOptimize(
     return result
 
 
-# a simple closure
+# a partial, rather than a closure, can be sent to the workers of ParallelSolve
 def make_optimizer_using(this_solver):
-    def optimizer(
-        w,
-        I,
-        J,
-        IJ,
-        budget_list,
-        parsimonious=True,
-        maxTimeInSeconds=5 * 60,
-        mipGap=1e-8,
-        trace=False,
-    ):
-        return OpenOptimize(
-            w,
-            I,
-            J,
-            IJ,
-            budget_list,
-            parsimonious,
-            maxTimeInSeconds,
-            mipGap,
-            trace,
-            this_solver,
-        )
-
-    return optimizer
+    return functools.partial(OpenOptimize, solver=this_solver)
 
 
 gurobicode = {
@@ -267,6 +252,73 @@ def Optimize(
     return result
 
 
+def OptimizeWithGRASP(
+    w,
+    I,
+    J,
+    IJ,
+    budget_list,
+    parsimonious=True,
+    maxTimeInSeconds=5 * 60,
+    mipGap=1e-8,
+    trace=False,
+    max_starts=100,
+):
+    """Solves the weighted maximum coverage problem with the GRASP heuristic of maxcovering, without a MIP solver
+
+    Has the signature of Optimize, so it can be passed as optimize to Solve.
+
+    Args:
+        w (array): w[i] is the weight of i in I
+        I (array): indices to be served
+        J (array): indices of potential services
+        IJ (dictionary of arrays): per i in I the list of j in J that may access a service in i
+        budget_list (list of integer): list of the maximum number of services to open
+        parsimonious (bool, optional): Not used, GRASP never opens useless services.
+        maxTimeInSeconds (float, optional): No new GRASP starts after this time, a cap on max_starts. Defaults to 5*60.
+        mipGap (float, optional): Not used.
+        trace (bool, optional): Print the number of starts. Defaults to False.
+        max_starts (int, optional): Number of GRASP starts. Defaults to 100.
+
+    Returns:
+        dataframe: one row per budget in budget_list and columns 'value','solution','modeling','solving','termination','upper'
+    """
+    start = pc()
+    result = pd.DataFrame(
+        index=budget_list,
+        columns=["value", "solution", "modeling", "solving", "termination", "upper"],
+    )
+
+    column = {j: c for c, j in enumerate(J)}
+    JI = {c: [] for c in range(len(J))}
+    for i in I:
+        for j in IJ[i]:
+            JI[column[j]].append(i)
+    JI = {c: np.array(i, dtype=int) for c, i in JI.items()}
+    modeling = pc() - start
+
+    grasp = mc.GRASP(
+        np.asarray(w),
+        IJ,
+        JI,
+        len(J),
+        budget_list,
+        max_starts=max_starts,
+        max_seconds=maxTimeInSeconds,
+    )
+    for p in budget_list:
+        result.at[p, "modeling"] = modeling
+        result.at[p, "solving"] = grasp[p]["solving"]
+        result.at[p, "value"] = grasp[p]["value"]
+        result.at[p, "solution"] = [J[c] for c in grasp[p]["solution"]]
+        result.at[p, "termination"] = "heuristic"
+        result.at[p, "upper"] = np.nan
+    if trace:
+        print(f"GRASP made {grasp[budget_list[0]]['starts']} starts")
+
+    return result
+
+
 def Greedy(w, IJ, JI, budget_list):
     budget_list = sorted(budget_list)
     result = pd.DataFrame(
@@ -276,32 +328,29 @@ def Greedy(w, IJ, JI, budget_list):
 
     start = pc()
     greedy_selected, greedy_added = [], []
+    w = np.asarray(w)
     coverage = np.zeros(len(w), dtype=np.uint16)
-    greedy_val = -np.ones(len(w), dtype=int)
 
-    J = list(JI.keys())
-    may_change = np.array(J)
-    prev = -1
+    # columns in the order of the facilities, which may be any sortable label
+    J = sorted(JI.keys())
+    A = od.CoverageMatrix({c: JI[j] for c, j in enumerate(J)}, len(w))
+    A_rows = A.tocsr()
+    gains = mc.GreedyGains(A, w, coverage)
     for p in budget_list:
-        for i in range(prev + 1, min(p, len(J))):
-            greedy_val[may_change] = [
-                w[JI[j][coverage[JI[j]] == 0]].sum() for j in may_change
-            ]
-            select = np.argmax(greedy_val)
-            if greedy_val[select] == 0:
-                break
-
-            coverage[JI[select]] += 1
-            greedy_selected.append(select)
-            greedy_added.append(greedy_val[select])
-
-            # Greedy only changes if coverage overlap with selected facility
-            may_change = np.unique(np.concatenate([IJ[i] for i in JI[select]]))
-        prev = i
+        mc.OpenGreedily(
+            gains,
+            A,
+            A_rows,
+            w,
+            coverage,
+            greedy_selected,
+            greedy_added,
+            min(p, len(J)),
+        )
 
         result.at[p, "solving"] = pc() - start
         result.at[p, "value"] = sum(greedy_added)
-        result.at[p, "solution"] = greedy_selected.copy()
+        result.at[p, "solution"] = [J[c] for c in greedy_selected]
         result.at[p, "increments"] = greedy_added.copy()
         result.at[p, "coverage"] = coverage.copy()
         start = pc()
@@ -319,6 +368,104 @@ def natural_keys(text):
     return [atoi(c) for c in re.split(r"(\d+)", text)]
 
 
+def SolveColumn(household, covered, reach, budgets, optimize=Optimize):
+    """Solves one distance column of Solve: optimally for the largest budget, then opens that solution in greedy steps
+
+    Args:
+        household (array): household[i] is the population of household i
+        covered (array): households already served by the current facilities within this distance
+        reach (dictionary of arrays): per potential facility the households within this distance
+        budgets (list of integer): list of the maximum number of services to open
+        optimize (function, optional): Optimize or a function with its signature. Defaults to Optimize.
+
+    Returns:
+        (series, series): per budget the coverage fraction and the solution of the greedy steps
+    """
+    percent_covered = household[covered].sum() / household.sum()
+
+    # First solve optimally for the largest budget
+    I, J, IJ, JI = od.CreateIndexMapping(reach, household, covered)
+    optimization = optimize(
+        household,
+        I,
+        J,
+        IJ,
+        [max(budgets)],
+        parsimonious=True,
+        maxTimeInSeconds=5,
+        mipGap=1e-15,
+    )
+    optimization["nof"] = [len(s) for s in optimization.solution]
+    coverage = (optimization.value / household.sum() + percent_covered).to_frame()
+    coverage["served"] = [
+        np.unique(
+            list(set(np.concatenate([reach[j] for j in s])).union(covered))
+        ).astype(np.uint)
+        for s in optimization.solution.values
+    ]
+    coverage["validation"] = [
+        household[s].sum() / household.sum() for s in coverage.served.values
+    ]
+
+    # Open the optimal solution in greedy steps
+    best = optimization.loc[optimization.index[-1]].solution
+    served = coverage.loc[coverage.index[-1]].served
+
+    bestJI = {j: i for j, i in JI.items() if j in best}
+    bestIJ = {i: [] for i in served}
+    for j, I in bestJI.items():
+        for i in I:
+            bestIJ[i].append(j)
+    bestIJ = {i: np.unique(j) for i, j in bestIJ.items() if len(j)}
+    greedy = Greedy(household, bestIJ, bestJI, budgets)
+    greedy["coverage"] = CoverageOfSolutions(
+        household, covered, reach, greedy.solution.values
+    )
+
+    return greedy["coverage"], greedy["solution"]
+
+
+def CoverageOfSolutions(household, covered, reach, solutions):
+    """Fraction of the population served by the current facilities and each of the solutions, evaluated at once on bitsets
+
+    Args:
+        household (array): household[i] is the population of household i
+        covered (array): households already served by the current facilities
+        reach (dictionary of arrays): per potential facility the households it serves
+        solutions (list of lists): the potential facilities of each solution
+
+    Returns:
+        array: per solution the fraction of the population served
+    """
+    # only the facilities in some solution are packed
+    facilities = list(dict.fromkeys(j for s in solutions for j in s))
+    column = {j: c for c, j in enumerate(facilities)}
+    # the current facilities are one more column, in every solution
+    JI = {c: reach[j] for c, j in enumerate(facilities)}
+    JI[len(facilities)] = covered
+    bits = od.PackCoverage(od.CoverageMatrix(JI, len(household)))
+    solutions = [[column[j] for j in s] + [len(facilities)] for s in solutions]
+    return mc.EvaluateSolutions(bits, np.asarray(household), solutions) / np.sum(
+        household
+    )
+
+
+def DistanceColumns(current, accessibility, type="ID"):
+    """The columns of current[accessibility] of the given type, largest distance first"""
+    columns = [c for c in current[accessibility].columns if c.startswith(type)]
+    columns.sort(key=natural_keys, reverse=True)
+    return columns
+
+
+def ColumnData(current, potential, accessibility, column):
+    """The households covered by the current facilities and the reach of the potential facilities within the distance column"""
+    covered = np.unique(np.concatenate(current[accessibility][column])).astype(np.uint)
+    aux = potential[accessibility][["Cluster_ID", column]].set_index(
+        "Cluster_ID", drop=True
+    )
+    return covered, aux[column].to_dict()
+
+
 def Solve(
     household, current, potential, accessibility, budgets, optimize=Optimize, type="ID"
 ):
@@ -328,83 +475,152 @@ def Solve(
     # "Distance"
 
     # ID_50km ID_100km ()
-    columns = [c for c in current[accessibility].columns if c.startswith(type)]
-    columns.sort(key=natural_keys, reverse=True)
     # For each distance value
-    for column in columns:
-        covered = np.unique(np.concatenate(current[accessibility][column])).astype(
-            np.uint
-        )
-        percent_covered = household[covered].sum() / household.sum()
+    for column in DistanceColumns(current, accessibility, type):
+        covered, reach = ColumnData(current, potential, accessibility, column)
+        coverage, solution = SolveColumn(household, covered, reach, budgets, optimize)
 
-        # First solve optimally for the largest budget
-        aux = potential[accessibility][["Cluster_ID", column]].set_index(
-            "Cluster_ID", drop=True
-        )
-        JI = {
-            j: np.setdiff1d(i, covered, assume_unique=True)
-            for j, i in aux[column].to_dict().items()
-        }
-        JI = {j: i for j, i in JI.items() if len(i)}
-        IJ = {
-            i: []
-            for i in np.setdiff1d(
-                np.arange(len(household)), covered, assume_unique=True
-            )
-        }
-        for j, I in JI.items():
-            for i in I:
-                if i in IJ.keys():
-                    IJ[i].append(j)
-        IJ = {i: np.unique(j) for i, j in IJ.items() if len(j)}
-        I = np.unique(list(IJ.keys()))
-        J = np.unique(np.concatenate(list(IJ.values())))
-        optimization = optimize(
-            household,
-            I,
-            J,
-            IJ,
-            [max(budgets)],
-            parsimonious=True,
-            maxTimeInSeconds=5,
-            mipGap=1e-15,
+        case = "_".join(column.split("_")[1:])
+        values[case] = coverage
+        solutions[case] = solution
+
+    return values, solutions
+
+
+def ShareArray(array, segments):
+    """Copies array to a new shared memory segment, appended to segments, and returns what AttachArray needs"""
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    segments.append(segment)
+    return segment.name, array.shape, array.dtype.str
+
+
+def AttachArray(shared, segments):
+    """The array shared by ShareArray, without copying, keeping its segment open in segments"""
+    name, shape, dtype = shared
+    segment = shared_memory.SharedMemory(name=name)
+    segments.append(segment)
+    return np.ndarray(shape, dtype, buffer=segment.buf)
+
+
+# data shared by the columns of ParallelSolve solved in a worker process
+_solve_data = dict()
+
+
+def _SolveWorkerInit(shared_household, shared_columns, threads):
+    # the segments stay attached for the life of the worker
+    segments = _solve_data.setdefault("segments", [])
+    _solve_data["household"] = AttachArray(shared_household, segments)
+    _solve_data["columns"] = shared_columns
+    try:
+        gb.setParam("Threads", threads)
+    except gb.GurobiError:
+        pass
+
+
+def _SolveWorkerColumn(column, budgets, optimize):
+    segments = _solve_data["segments"]
+    covered, facilities, start, households = (
+        AttachArray(shared, segments) for shared in _solve_data["columns"][column]
+    )
+    reach = {
+        j: households[start[k] : start[k + 1]]
+        for k, j in enumerate(facilities.tolist())
+    }
+    return SolveColumn(_solve_data["household"], covered, reach, budgets, optimize)
+
+
+def ParallelSolve(
+    household,
+    current,
+    potential,
+    accessibility,
+    budgets,
+    optimize=Optimize,
+    type="ID",
+    nof_workers=None,
+    max_threads=None,
+):
+    """Solve with the distance columns solved in parallel, in a pool of processes
+
+    The population and, per column, the households covered and the reach of the potential facilities are
+    placed once in shared memory, instead of being sent with each column.
+
+    Args:
+        household (array): household[i] is the population of household i
+        current (dictionary of dataframes): per accessibility the households served by the current facilities
+        potential (dictionary of dataframes): per accessibility the households served by the potential facilities
+        accessibility (string): the key of current and potential to use
+        budgets (list of integer): list of the maximum number of services to open
+        optimize (function, optional): Optimize or a function with its signature, that can be pickled. Defaults to Optimize.
+        type (string, optional): prefix of the distance columns. Defaults to "ID".
+        nof_workers (integer, optional): Number of processes, 1 solves in this process. Defaults to one per column, at most max_threads.
+        max_threads (integer, optional): Total number of solver threads, shared among the workers. Defaults to the number of cpus.
+
+    Returns:
+        (dataframe, dataframe): values and solutions as returned by Solve
+    """
+    columns = DistanceColumns(current, accessibility, type)
+    max_threads = max_threads or os.cpu_count()
+    nof_workers = max(1, min(nof_workers or len(columns), max_threads, len(columns)))
+    if nof_workers == 1:
+        return Solve(
+            household, current, potential, accessibility, budgets, optimize, type
         )
-        optimization["nof"] = [len(s) for s in optimization.solution]
-        coverage = (optimization.value / household.sum() + percent_covered).to_frame()
-        coverage["served"] = [
-            np.unique(
-                list(set(np.concatenate(list(aux.loc[s][column]))).union(covered))
-            ).astype(np.uint)
-            for s in optimization.solution.values
-        ]
-        coverage["validation"] = [
-            household[s].sum() / household.sum() for s in coverage.served.values
-        ]
-
-        # Open the optimal solution in greedy steps
-        best = optimization.loc[optimization.index[-1]].solution
-        served = coverage.loc[coverage.index[-1]].served
-
-        bestJI = {j: i for j, i in JI.items() if j in best}
-        bestIJ = {i: [] for i in served}
-        for j, I in bestJI.items():
-            for i in I:
-                bestIJ[i].append(j)
-        bestIJ = {i: np.unique(j) for i, j in bestIJ.items() if len(j)}
-        greedy = Greedy(household, bestIJ, bestJI, budgets)
-        greedy["served"] = [
-            np.unique(
-                list(set(np.concatenate(list(aux.loc[s][column]))).union(covered))
-            ).astype(np.uint)
-            for s in greedy.solution.values
-        ]
-        greedy["coverage"] = [
-            household[s].sum() / household.sum() for s in greedy.served.values
-        ]
 
+    segments = []
+    threads = max(1, max_threads // nof_workers)
+    # the workers are spawned, and so start their thread pools, with the environment of the pool
+    environment = {
+        variable: str(threads)
+        for variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+    }
+    saved = {variable: os.environ.get(variable) for variable in environment}
+    try:
+        shared_household = ShareArray(np.asarray(household), segments)
+        shared_columns = dict()
+        for column in columns:
+            covered, reach = ColumnData(current, potential, accessibility, column)
+            households = [np.asarray(i, dtype=np.uint) for i in reach.values()]
+            start = np.cumsum([0] + [len(i) for i in households])
+            shared_columns[column] = [
+                ShareArray(array, segments)
+                for array in (
+                    covered,
+                    np.asarray(list(reach.keys())),
+                    start,
+                    np.concatenate(households) if households else np.empty(0, np.uint),
+                )
+            ]
+
+        os.environ.update(environment)
+        with ProcessPoolExecutor(
+            nof_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_SolveWorkerInit,
+            initargs=(shared_household, shared_columns, threads),
+        ) as pool:
+            futures = {
+                column: pool.submit(_SolveWorkerColumn, column, budgets, optimize)
+                for column in columns
+            }
+            solved = {column: future.result() for column, future in futures.items()}
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    values = pd.DataFrame()
+    solutions = pd.DataFrame()
+    for column in columns:
         case = "_".join(column.split("_")[1:])
-        values[case] = greedy["coverage"]
-        solutions[case] = greedy["solution"]
+        values[case], solutions[case] = solved[column]
 
     return values, solutions
 
@@ -457,20 +673,8 @@ def ComputeCoverageFromSolutions(
     for accessibility in accessibilities:
         coverage[accessibility] = pd.DataFrame(index=result[accessibility][1].index)
         for col in result[accessibility][1].columns:
-            column = "ID_" + col
-            covered = np.unique(
-                np.concatenate(current[accessibility][column].values)
-            ).astype(np.uint)
-            aux = potential[accessibility][["Cluster_ID", column]].set_index(
-                "Cluster_ID", drop=True
+            covered, reach = ColumnData(current, potential, accessibility, "ID_" + col)
+            coverage[accessibility][col] = CoverageOfSolutions(
+                household, covered, reach, result[accessibility][1][col].values
             )
-            served = [
-                np.unique(
-                    list(set(np.concatenate(list(aux.loc[s][column]))).union(covered))
-                ).astype(np.uint)
-                for s in result[accessibility][1][col].values
-            ]
-            coverage[accessibility][col] = [
-                household[s].sum() / household.sum() for s in served
-            ]
     return coverage
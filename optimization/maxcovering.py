@@ -49,10 +49,18 @@ re-implementations of those by Fleur.
 Also includes an heuristic from Church and ReVelle that is not part of Fleur's
 thesis.
 
-Is still lacks a number of heuristics from Fleur:
- - 'adaptive' version of LocalSearch that tries to avoid hopeless attempts.
- - GRASP
- - path relinking
+GRASP, also from Fleur, runs its independent starts in a process pool. Her
+path relinking between elite solutions and 'adaptive' version of LocalSearch
+that tries to avoid hopeless attempts are stages of HeuristicPipeline.
+
+LagrangianRelaxation bounds the optimal coverage, and so certifies the gap of
+a solution, without a MIP solver.
+
+EvaluateSolutions and AdditionGains evaluate many solutions, or the addition
+of every facility, at once on the coverage packed as bitsets.
+
+AnytimeSolve runs the solvers that accept a callback in the background,
+streaming their incumbents and bounds, and can stop them early.
 
 Besides functions documented with docstring, this model also exports the
 following:
@@ -61,10 +69,18 @@ verbose_gurobi_code : dict to description of the termination codes of gurobi
 """
 
 from time import perf_counter as pc
+from typing import Iterator
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import copy
+import os
+import heapq
+import threading
 import numpy as np
+import scipy.sparse as sp
 import gurobipy as gb
+import highspy
 import pyomo.environ as pyo
+from pyomo.contrib import appsi
 
 # own modules
 import optdata as od
@@ -126,12 +142,56 @@ def GetPyomoSolver(solverName: str,
             solver.options['MipGap'] = mipGap
     return solver
 
+
+appsi_solvers = dict(highs=appsi.solvers.Highs,
+                     gurobi=appsi.solvers.Gurobi,
+                     cplex=appsi.solvers.Cplex,
+                     cbc=appsi.solvers.Cbc)
+
+
+def GetAppsiSolver(solverName: str,
+                   timeLimit: float = None,
+                   mipGap: float = None) -> appsi.base.PersistentSolver:
+    """
+    This function returns a persistent Pyomo (APPSI) solver object based on
+    the solver name, with or without the prefix 'appsi_'. Sets the time
+    limit and mip gap if provided.
+
+    Parameters
+    ----------
+    solverName : str
+        Name of the solver to be used, one of appsi_solvers.
+    timeLimit : float, optional
+        Time limit for the solver (default None) in seconds.
+    mipGap : float, optional
+        MIP gap for the solver. The default (None) uses the default specific
+        to each solver.
+
+    Returns
+    -------
+    appsi.base.PersistentSolver
+        Persistent Pyomo solver object.
+    """
+    name = solverName.removeprefix('appsi_')
+    if name not in appsi_solvers:
+        raise ValueError(f'No persistent solver {solverName}')
+    solver = appsi_solvers[name]()
+    if timeLimit:
+        solver.config.time_limit = timeLimit
+    if mipGap and 'mip_gap' in solver.config:
+        solver.config.mip_gap = mipGap
+    if 'warmstart' in solver.config:
+        solver.config.warmstart = True
+    return solver
+
+
 def OptimizeWithPyomo(w: list, I: list,  # noqa: E741
                       J: list, IJ: dict, budget_list: list,
                       parsimonious: bool = True, maxTimeInSeconds: int = 5*60,
                       mipGap: float = 1e-8, trace: bool = False,
                       already_open: list = [], solver: str = 'cbc',
-                      progress: callable = lambda iterable: iterable) \
+                      progress: callable = lambda iterable: iterable,
+                      persistent: bool = False, warm_start: bool = True) \
                           -> dict[int, dict[str, any]]:
     """
     Instantiates and solves the weighted maximal covering problem with the
@@ -167,6 +227,14 @@ def OptimizeWithPyomo(w: list, I: list,  # noqa: E741
     progress : callable, optional
         Callable (function) to use for progress tracking (default is the
         identity).
+    persistent : bool, optional
+        Whether to use the persistent (APPSI) interface of the solver, see
+        GetAppsiSolver, which keeps the model in the solver and only updates
+        the budget between budgets (default is False).
+    warm_start : bool, optional
+        Whether to start each solve from the solution of the previous budget
+        if within the budget and better, otherwise from the greedy solution,
+        for solvers that accept a start (default is True).
 
     Returns
     -------
@@ -221,31 +289,482 @@ def OptimizeWithPyomo(w: list, I: list,  # noqa: E741
     def in_the_budget(M):
         return M.nof_open_facilities <= M.budget
 
-    solver = GetPyomoSolver(solver, maxTimeInSeconds, mipGap)
+    if persistent:
+        solver = GetAppsiSolver(solver, maxTimeInSeconds, mipGap)
+        solver.config.stream_solver = trace
+        solver.set_instance(M)
+        warm_start = warm_start and ('warmstart' in solver.config
+                                     or hasattr(solver, 'set_var_attr'))
+    else:
+        solver = GetPyomoSolver(solver, maxTimeInSeconds, mipGap)
+        warm_start = warm_start and hasattr(solver, 'warm_start_capable') \
+            and solver.warm_start_capable()
+
+    if warm_start:
+        weight = np.asarray(w, dtype=float)[I]
+        A = od.IndexedCoverageMatrix(I, J, IJ)
+        open_columns = np.searchsorted(J, already_open)
+        greedy = GreedyOpenings(A, weight, open_columns,
+                                min(max(budget_list), len(J)))
+        previous = None
+
+    def Start(p):
+        x = np.zeros(len(J))
+        x[open_columns] = 1
+        x[greedy[:p]] = 1
+        if previous is not None and previous.sum() <= p + len(already_open) \
+                and weight @ (A @ previous > .5) > weight @ (A @ x > .5):
+            x = previous
+        for c, j in enumerate(J):
+            M.X[j].value = x[c]
+        for r, covered in enumerate(A @ x > .5):
+            M.Y[I[r]].value = int(covered)
+        if hasattr(solver, 'set_var_attr'):
+            # the persistent gurobi interface takes starts as attributes
+            for j in J:
+                solver.set_var_attr(M.X[j], 'Start', M.X[j].value)
 
     for p in progress(budget_list):
         M.budget = p + len(already_open)
+        if warm_start:
+            Start(p)
         modeling = pc()-start
         start = pc()
-        solver_result = solver.solve(M, tee=trace)
+        if persistent:
+            solver_result = solver.solve(M)
+            termination = solver_result.termination_condition
+            upper = solver_result.best_objective_bound
+        else:
+            solver_result = solver.solve(M, tee=trace,
+                                         **dict(warmstart=True)
+                                         if warm_start else dict())
+            termination = solver_result.solver.termination_condition
+            upper = solver_result.problem.upper_bound
+        solution = [j for j, x in M.X.items() if x() > .5]
         result[p] = dict(
             modeling=modeling,
             solving=pc()-start,
             value=0+M.weighted_coverage(),
-            solution=[j for j,x in M.X.items() if x() > .5],
-            termination=solver_result.solver.termination_condition,
-            upper=0+solver_result.problem.upper_bound)
+            solution=solution,
+            termination=termination,
+            upper=0+upper)
+        if warm_start:
+            previous = np.isin(J, solution).astype(float)
+        start = pc()
+
+    return result
+
+
+def HighsCoverageModel(weight: np.ndarray, A: sp.csr_matrix,
+                       is_open: np.ndarray, coef_x: float, trace: bool,
+                       mipGap: float, maxTimeInSeconds: float) \
+                           -> highspy.Highs:
+    """
+    The weighted maximal covering model in highspy, with columns X then Y
+    and rows serve_if_open (Y - A X <= 0) then the budget, whose upper bound
+    is to be set, see OptimizeWithHighs.
+    """
+    nof_x, nof_y = A.shape[1], A.shape[0]
+    matrix = sp.vstack([
+        sp.hstack([-A, sp.identity(nof_y, format='csr')]),
+        sp.hstack([np.ones((1, nof_x)), sp.csr_matrix((1, nof_y))])
+    ], format='csc')
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = nof_x + nof_y
+    lp.num_row_ = nof_y + 1
+    lp.sense_ = highspy.ObjSense.kMaximize
+    lp.col_cost_ = np.concatenate([np.full(nof_x, coef_x), weight])
+    lp.col_lower_ = np.concatenate([is_open.astype(float), np.zeros(nof_y)])
+    lp.col_upper_ = np.ones(nof_x + nof_y)
+    lp.row_lower_ = np.full(nof_y + 1, -highspy.kHighsInf)
+    lp.row_upper_ = np.zeros(nof_y + 1)
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = matrix.indptr
+    lp.a_matrix_.index_ = matrix.indices
+    lp.a_matrix_.value_ = matrix.data.astype(float)
+    lp.integrality_ = [highspy.HighsVarType.kInteger] * (nof_x + nof_y)
+
+    M = highspy.Highs()
+    M.setOptionValue('output_flag', trace)
+    M.setOptionValue('mip_rel_gap', mipGap)
+    M.setOptionValue('time_limit', float(maxTimeInSeconds))
+    M.passModel(lp)
+    return M
+
+
+def RelayHighs(M: highspy.Highs, weight: np.ndarray, J: list,
+               callback: callable, cancelled: callable) -> dict:
+    """
+    Passes the improving solutions and the changes of the dual bound of M,
+    see HighsCoverageModel, to callback(p, update) for the budget p in the
+    returned state['budget'], with update a dict of the 'value', 'solution'
+    and 'upper' known. Once callback returns True, or cancelled() does at any
+    interrupt check of the MIP solver or of the simplex and interior point
+    solvers of its LP relaxations, state['stop'] is set and M is
+    interrupted. Either callable may be None.
+    """
+    state = dict(budget=None, stop=False, upper=None)
+    nof_x = len(J)
+    kind = highspy.cb.HighsCallbackType
+    interrupts = (kind.kCallbackMipInterrupt, kind.kCallbackSimplexInterrupt,
+                  kind.kCallbackIpmInterrupt)
+
+    def Relay(event, message, data_out, data_in, user_data):
+        update = None
+        if event == kind.kCallbackMipImprovingSolution:
+            x = np.asarray(data_out.mip_solution)
+            update = dict(value=weight @ x[nof_x:],
+                          solution=[J[c] for c in np.flatnonzero(
+                              x[:nof_x] > .5)],
+                          upper=data_out.mip_dual_bound)
+        elif event == kind.kCallbackMipInterrupt \
+                and data_out.mip_dual_bound != state['upper']:
+            update = dict(upper=data_out.mip_dual_bound)
+        if update is not None:
+            state['upper'] = data_out.mip_dual_bound
+            if callback:
+                state['stop'] |= bool(callback(state['budget'], update))
+        if cancelled and cancelled():
+            state['stop'] = True
+        if state['stop'] and event in interrupts:
+            data_in.user_interrupt = True
+
+    M.setCallback(Relay, None)
+    M.startCallback(kind.kCallbackMipImprovingSolution)
+    for event in interrupts:
+        M.startCallback(event)
+    return state
+
+
+def OptimizeWithHighs(w: list, I: list,  # noqa: E741
+                      J: list, IJ: dict, budget_list: list,
+                      parsimonious: bool = True, maxTimeInSeconds: int = 5*60,
+                      mipGap: float = 1e-8, trace: bool = False,
+                      already_open: list = [],
+                      progress: callable = lambda iterable: iterable,
+                      callback: callable = None,
+                      cancelled: callable = None) \
+                          -> dict[int, dict[str, any]]:
+    """
+    Instantiates the weighted maximal covering problem directly in highspy,
+    from the sparse coverage matrix, and solves it with HiGHS. Between
+    budgets only the right hand side of the budget constraint changes. Each
+    solve starts from the better of the previous solution, if within the
+    budget, and the greedy solution, which is also the result of the budget
+    if the solve is stopped before it finds a better one.
+
+    Parameters
+    ----------
+    w : list
+        List of sizes of each household.
+    I : list
+        List of indices of households.
+    J : list
+        List of indices if (potential) locations.
+    IJ : dict
+        Dictionary of households to the locations within reach.
+    budget_list : list
+        List of budgets to optimize for.
+        These limit the number of facilities to select, in addition to those
+        (if any) listed in already_open.
+    parsimonious : bool, optional
+        Whether to optimize minimize the number of open facilities needed to
+        reach the optimal coverage (default is True).
+    maxTimeInSeconds : int, optional
+        Maximum time in seconds to run the optimization (default is 5*60).
+    mipGap : float, optional
+        MIP gap to use for optimization (default is 1e-8).
+    trace : bool, optional
+        Whether to trace the optimization (default is False).
+    already_open : list, optional
+        List of facilities that are already open (default is []).
+    progress : callable, optional
+        Callable (function) to use for progress tracking (default is the
+        identity).
+    callback : callable, optional
+        Called as callback(p, update) with each improving solution and dual
+        bound of budget p, update holding the 'value', 'solution' and
+        'upper' known, and with the result of budget p once it is solved.
+        Returning True stops the solve, skipping the remaining budgets, see
+        AnytimeSolve (default is None).
+    cancelled : callable, optional
+        Checked at every interrupt check of the solver and between budgets,
+        returning True stops the solve as callback does, for instance the
+        is_set of a threading.Event (default is None).
+
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts containing the optimization results at the outer level
+        one entry per budget in budget_list and the inner level 'value',
+        'solution','modeling','solving', 'termination','upper'
+    """
+
+    # ensure that all facilities already open are given to a variable
+    J = sorted(set(J) | set(already_open))
+
+    # ensure that only reachable customers are considered
+    I = sorted(set(I) & set(IJ.keys()))  # noqa: E741
+
+    result = dict()
+
+    start = pc()
+
+    weight = np.asarray(w, dtype=float)[I]
+    A = od.IndexedCoverageMatrix(I, J, IJ)
+    nof_x, nof_y = len(J), len(I)
+    open_columns = np.searchsorted(J, already_open)
+    coef_x = -1/(max(budget_list)+1) if parsimonious else 0
+    greedy = GreedyOpenings(A, weight, open_columns,
+                            min(max(budget_list), nof_x - len(open_columns)))
+
+    M = HighsCoverageModel(weight, A, np.isin(J, already_open), coef_x,
+                           trace, mipGap, maxTimeInSeconds)
+    relay = RelayHighs(M, weight, J, callback, cancelled)
+
+    def Objective(x):
+        return weight @ (A @ x > .5) + coef_x * x.sum()
+
+    previous = None
+    for p in progress(budget_list):
+        if cancelled and cancelled():
+            break
+        relay['budget'] = p
+        M.changeRowBounds(nof_y, -highspy.kHighsInf, p + len(already_open))
+        x = np.zeros(nof_x)
+        x[open_columns] = 1
+        x[greedy[:p]] = 1
+        if previous is not None \
+                and previous.sum() <= p + len(already_open) \
+                and Objective(previous) >= Objective(x):
+            x = previous
+        covered = (A @ x > .5).astype(float)
+        start_solution = highspy.HighsSolution()
+        start_solution.col_value = list(np.concatenate([x, covered]))
+        M.setSolution(start_solution)
+        if callback:
+            relay['stop'] |= bool(callback(p, dict(
+                value=weight @ covered,
+                solution=[J[c] for c in np.flatnonzero(x)])))
+        modeling = pc()-start
+        start = pc()
+        termination, upper = 'interrupted by user', weight.sum()
+        if not relay['stop']:
+            M.run()
+            values = np.array(M.getSolution().col_value)
+            if len(values) == nof_x + nof_y \
+                    and Objective(np.round(values[:nof_x])) >= Objective(x):
+                x = np.round(values[:nof_x])
+            termination = M.modelStatusToString(M.getModelStatus()).lower()
+            upper = min(upper, M.getInfo().mip_dual_bound)
+        previous = x
+        result[p] = dict(
+            modeling=modeling,
+            solving=pc()-start,
+            value=weight @ (A @ x > .5),
+            solution=[J[c] for c in np.flatnonzero(x > .5)],
+            termination=termination,
+            upper=upper)
+        if (callback and callback(p, result[p])) or relay['stop']:
+            break
         start = pc()
 
     return result
 
 
+def BudgetCurve(w: list, I: list,  # noqa: E741
+                J: list, IJ: dict, max_budget: int,
+                parsimonious: bool = True, maxTimeInSeconds: int = 5*60,
+                mipGap: float = 1e-8, trace: bool = False,
+                already_open: list = [],
+                callback: callable = None,
+                cancelled: callable = None) -> Iterator[tuple[int, dict]]:
+    """
+    Computes the exact optimal coverage for every budget from 0 to
+    max_budget with HiGHS, yielding each budget as soon as it is done.
+
+    Each budget starts from the best of the previous solution plus its
+    best greedy addition and the greedy solution. Since removing the least
+    useful of p opened facilities loses at most 1/p of the coverage, and at
+    most the largest catchment area, the upper bound of budget p - 1 bounds
+    budget p: if the start reaches this bound (up to mipGap) the budget is
+    not solved. Once all households are covered, larger budgets are not
+    solved either.
+
+    Parameters
+    ----------
+    w : list
+        List of sizes of each household.
+    I : list
+        List of indices of households.
+    J : list
+        List of indices if (potential) locations.
+    IJ : dict
+        Dictionary of households to the locations within reach.
+    max_budget : int
+        The largest budget, in addition to the facilities already open.
+    parsimonious : bool, optional
+        Whether to optimize minimize the number of open facilities needed to
+        reach the optimal coverage (default is True).
+    maxTimeInSeconds : int, optional
+        Maximum time in seconds per budget (default is 5*60).
+    mipGap : float, optional
+        MIP gap to use for optimization (default is 1e-8).
+    trace : bool, optional
+        Whether to trace the optimization (default is False).
+    already_open : list, optional
+        List of facilities that are already open (default is []).
+    callback : callable, optional
+        As in OptimizeWithHighs: returning True ends the curve (default is
+        None).
+    cancelled : callable, optional
+        As in OptimizeWithHighs, ends the curve (default is None).
+
+    Yields
+    ------
+    p, result : tuple[int, dict]
+        The budget and a dict with the 'value' (coverage), 'solution',
+        'modeling', 'solving', 'termination' ('pruned' or 'saturated' if not
+        solved), 'upper' and 'gap' of that budget.
+    """
+
+    # ensure that all facilities already open are given to a variable
+    J = sorted(set(J) | set(already_open))
+
+    # ensure that only reachable customers are considered
+    I = sorted(set(I) & set(IJ.keys()))  # noqa: E741
+
+    start = pc()
+
+    weight = np.asarray(w, dtype=float)[I]
+    integer = np.issubdtype(np.asarray(w).dtype, np.integer)
+    A = od.IndexedCoverageMatrix(I, J, IJ)
+    A_columns = A.tocsc()
+    nof_x = len(J)
+    open_columns = np.searchsorted(J, already_open)
+    coef_x = -1/(max_budget+1) if parsimonious else 0
+    total = weight.sum()
+    largest = (A.T @ weight).max(initial=0)
+    greedy = GreedyOpenings(A, weight, open_columns,
+                            min(max_budget, nof_x - len(open_columns)))
+
+    M = HighsCoverageModel(weight, A, np.isin(J, already_open), coef_x,
+                           trace, mipGap, maxTimeInSeconds)
+    relay = RelayHighs(M, weight, J, callback, cancelled)
+
+    def Value(x):
+        return weight @ (A @ x > .5)
+
+    def Round(bound):
+        return np.floor(bound + 1e-9) if integer else bound
+
+    x = np.zeros(nof_x)
+    x[open_columns] = 1
+    upper = Value(x)
+    for p in range(max_budget + 1):
+        if cancelled and cancelled():
+            return
+        relay['budget'] = p
+        # the best start for budget p
+        coverage = SolutionCoverage(A_columns, np.flatnonzero(x))
+        gains = GreedyGains(A_columns, weight, coverage)
+        if p and gains.max(initial=0) > 0:
+            x = x.copy()
+            x[np.argmax(gains)] = 1
+        x_greedy = np.zeros(nof_x)
+        x_greedy[open_columns] = 1
+        x_greedy[greedy[:p]] = 1
+        if Value(x_greedy) > Value(x):
+            x = x_greedy
+        value = Value(x)
+
+        if p:
+            upper = min(total, upper + largest,
+                        upper * p / (p - 1) if p > 1 else np.inf)
+        upper = Round(upper)
+        modeling = pc() - start
+        start = pc()
+
+        if value >= total:
+            termination, upper = 'saturated', value
+        elif value >= upper * (1 - mipGap):
+            termination = 'pruned'
+        else:
+            M.changeRowBounds(A.shape[0], -highspy.kHighsInf,
+                              p + len(already_open))
+            start_solution = highspy.HighsSolution()
+            start_solution.col_value = list(np.concatenate(
+                [x, (A @ x > .5).astype(float)]))
+            M.setSolution(start_solution)
+            M.run()
+            values = np.array(M.getSolution().col_value)
+            if len(values) == nof_x + A.shape[0]:
+                solved = np.round(values[:nof_x])
+                if Value(solved) + coef_x * solved.sum() \
+                        >= value + coef_x * x.sum():
+                    x, value = solved, Value(solved)
+            termination = M.modelStatusToString(M.getModelStatus()).lower()
+            # the objective counts the open facilities, at most p of them
+            upper = min(upper, Round(M.getInfo().mip_dual_bound
+                                     - coef_x * (p + len(already_open))))
+
+        result = dict(modeling=modeling,
+                      solving=pc() - start,
+                      value=value,
+                      solution=[J[c] for c in np.flatnonzero(x > .5)],
+                      termination=termination,
+                      upper=upper,
+                      gap=(upper - value) / upper if upper > 0 else 0)
+        yield p, result
+        if (callback and callback(p, result)) or relay['stop']:
+            return
+        start = pc()
+
+
+def RelayGurobi(X: list, Y: list, weight: np.ndarray, J: list,
+                callback: callable,
+                cancelled: callable) -> tuple[callable, dict]:
+    """
+    The gurobi callback passing the improving solutions and the changes of
+    the dual bound of the model with variables X (over J) and Y (with
+    weight) to callback(p, update), and checking cancelled() at every call,
+    as RelayHighs, and its state.
+    """
+    state = dict(budget=None, stop=False, upper=None)
+    where = gb.GRB.Callback
+
+    def Relay(model, event):
+        update = None
+        if event == where.MIPSOL:
+            x = np.asarray(model.cbGetSolution(X))
+            update = dict(value=weight @ np.asarray(model.cbGetSolution(Y)),
+                          solution=[J[c] for c in np.flatnonzero(x > .5)],
+                          upper=model.cbGet(where.MIPSOL_OBJBND))
+        elif event == where.MIP \
+                and model.cbGet(where.MIP_OBJBND) != state['upper']:
+            update = dict(upper=model.cbGet(where.MIP_OBJBND))
+        if update is not None:
+            state['upper'] = update['upper']
+            if callback:
+                state['stop'] |= bool(callback(state['budget'], update))
+        if cancelled and cancelled():
+            state['stop'] = True
+        if state['stop']:
+            model.terminate()
+
+    return Relay, state
+
+
 def OptimizeWithGurobipy(w: list, I: list,  # noqa: E741
                          J: list, IJ: dict,
                          budget_list: list, parsimonious: bool = True,
                          maxTimeInSeconds: int = 5*60, mipGap: float = 1e-8,
                          trace: bool = False, already_open: list = [],
-                         progress: callable = lambda iterable: iterable) \
+                         progress: callable = lambda iterable: iterable,
+                         matrix_api: bool = True,
+                         callback: callable = None,
+                         cancelled: callable = None) \
                              -> dict[int, dict[str, any]]:
     """
     Instantiates the weighted maximal covering problem using gurobipy for the
@@ -281,6 +800,17 @@ def OptimizeWithGurobipy(w: list, I: list,  # noqa: E741
     progress : callable, optional
         Callable (function) to use for progress tracking (default is the
         identity).
+    matrix_api : bool, optional
+        Whether to build the model in one call from the sparse coverage
+        matrix A, as Y - A X <= 0 with addMConstr, instead of one constraint
+        per household (default is True).
+    callback : callable, optional
+        As in OptimizeWithHighs: called with the improving solutions, dual
+        bounds and results of each budget, returning True stops the solve
+        (default is None).
+    cancelled : callable, optional
+        As in OptimizeWithHighs, checked at every gurobi callback (default is
+        None).
 
     Returns
     -------
@@ -296,6 +826,12 @@ def OptimizeWithGurobipy(w: list, I: list,  # noqa: E741
     # ensure that only reachable customers are considered
     I = sorted(set(I) & set(IJ.keys()))  # noqa: E741
 
+    if matrix_api:
+        return OptimizeWithGurobipyMatrix(w, I, J, IJ, budget_list,
+                                          parsimonious, maxTimeInSeconds,
+                                          mipGap, trace, already_open,
+                                          progress, callback, cancelled)
+
     result = dict()
     start = pc()
 
@@ -317,27 +853,551 @@ def OptimizeWithGurobipy(w: list, I: list,  # noqa: E741
 
     M.addConstrs((Y[i] <= (gb.quicksum(X[j] for j in IJ[i]))) for i in I)
     budget = M.addLConstr(X.sum() >= 0)
+    relay, state = RelayGurobi(list(X.values()), list(Y.values()),
+                               np.asarray(w)[I], J, callback, cancelled)
 
     for p in progress(budget_list):
+        if cancelled and cancelled():
+            break
         M.remove(budget)
         budget = M.addLConstr(X.sum() <= p + len(already_open))
+        state['budget'] = p
         modeling = pc()-start
         start = pc()
-        M.optimize()
+        M.optimize(relay)
         result[p] = dict(modeling=modeling,
                          solving=pc()-start,
                          value=0+M.objVal,
                          solution=[j for j in J if X[j].x > .5],
                          termination=verbose_gurobi_code[M.status],
                          upper=0+M.ObjBound)
+        if (callback and callback(p, result[p])) or state['stop']:
+            break
+        start = pc()
+
+    return result
+
+
+def OptimizeWithGurobipyMatrix(w: list, I: list,  # noqa: E741
+                               J: list, IJ: dict, budget_list: list,
+                               parsimonious: bool, maxTimeInSeconds: int,
+                               mipGap: float, trace: bool,
+                               already_open: list, progress: callable,
+                               callback: callable = None,
+                               cancelled: callable = None) \
+                                   -> dict[int, dict[str, any]]:
+    """
+    OptimizeWithGurobipy with the model built by the matrix API, for sorted
+    J containing already_open and I restricted to the keys of IJ.
+    """
+    result = dict()
+    start = pc()
+
+    M = gb.Model('max_coverage')
+    M.ModelSense = gb.GRB.MAXIMIZE
+
+    M.Params.OutputFlag = trace
+    M.Params.MIPGap = mipGap
+    M.Params.TimeLimit = maxTimeInSeconds
+
+    A = od.IndexedCoverageMatrix(I, J, IJ)
+    coef_x = -1/(max(budget_list)+1) if parsimonious else 0
+    X = M.addMVar(len(J), obj=coef_x, vtype=gb.GRB.BINARY)
+    Y = M.addMVar(len(I), obj=np.asarray(w)[I], vtype=gb.GRB.BINARY)
+
+    X.lb = np.isin(J, already_open).astype(float)
+
+    # columns in the order of the variables, X then Y
+    M.addMConstr(sp.hstack([-A, sp.identity(len(I), format='csr')],
+                           format='csr'),
+                 None, gb.GRB.LESS_EQUAL, np.zeros(len(I)))
+    budget = M.addConstr(X.sum() >= 0)
+    relay, state = RelayGurobi(X, Y, np.asarray(w)[I], J, callback,
+                               cancelled)
+
+    for p in progress(budget_list):
+        if cancelled and cancelled():
+            break
+        M.remove(budget)
+        budget = M.addConstr(X.sum() <= p + len(already_open))
+        state['budget'] = p
+        modeling = pc()-start
+        start = pc()
+        M.optimize(relay)
+        result[p] = dict(modeling=modeling,
+                         solving=pc()-start,
+                         value=0+M.objVal,
+                         solution=[J[c] for c in np.flatnonzero(X.X > .5)],
+                         termination=verbose_gurobi_code[M.status],
+                         upper=0+M.ObjBound)
+        if (callback and callback(p, result[p])) or state['stop']:
+            break
         start = pc()
 
     return result
 
 
+def OptimizeWithBenders(w: list, I: list,  # noqa: E741
+                        J: list, IJ: dict, budget_list: list,
+                        parsimonious: bool = True,
+                        maxTimeInSeconds: int = 5*60, mipGap: float = 1e-8,
+                        trace: bool = False, already_open: list = [],
+                        nof_groups: int = 8, max_lp_rounds: int = 100,
+                        progress: callable = lambda iterable: iterable) \
+                            -> dict[int, dict[str, any]]:
+    """
+    Solves the weighted maximal covering problem by Benders decomposition,
+    after Cordeau, Furini and Ljubic (2019), with HiGHS.
+
+    The master problem has only the facility variables X and one coverage
+    variable per group of households (nof_groups contiguous groups). For a
+    (possibly fractional) X the optimal dual of the coverage subproblem of
+    household i is w[i] if it is covered more than once and w[i] per
+    facility reaching it otherwise, giving the cut, per group,
+    coverage <= sum(w[i] for i covered more than once)
+                + sum(w[i] * X[j] for the other i and j in IJ[i]).
+    Cuts are first separated on the LP relaxation, then the master MIP is
+    re-solved, started from the best solution known (initially greedy),
+    until its solution violates no cut. HiGHS does not support lazy
+    constraints in its branch and bound, hence the re-solves. Cuts are kept
+    across budgets.
+
+    Parameters
+    ----------
+    w : list
+        List of sizes of each household.
+    I : list
+        List of indices of households.
+    J : list
+        List of indices if (potential) locations.
+    IJ : dict
+        Dictionary of households to the locations within reach.
+    budget_list : list
+        List of budgets to optimize for. These limit the number of facilities
+        to select, in addition to those (if any) listed in already_open.
+    parsimonious : bool, optional
+        Whether to optimize minimize the number of open facilities needed to
+        reach the optimal coverage (default is True).
+    maxTimeInSeconds : int, optional
+        Maximum time in seconds per budget (default is 5*60).
+    mipGap : float, optional
+        MIP gap of the master problem (default is 1e-8).
+    trace : bool, optional
+        Whether to show the solver log (default is False).
+    already_open : list, optional
+        List of facilities that are already open (default is []).
+    nof_groups : int, optional
+        Number of coverage variables of the master problem (default is 8).
+    max_lp_rounds : int, optional
+        Maximum number of cut rounds on the LP relaxation per budget
+        (default is 100).
+    progress : callable, optional
+        Callable (function) to use for progress tracking (default is the
+        identity).
+
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts containing the optimization results at the outer level
+        one entry per budget in budget_list and the inner level 'value',
+        'solution','modeling','solving', 'termination','upper' and 'cuts'
+    """
+
+    # ensure that all facilities already open are given to a variable
+    J = sorted(set(J) | set(already_open))
+
+    # ensure that only reachable customers are considered
+    I = sorted(set(I) & set(IJ.keys()))  # noqa: E741
+
+    result = dict()
+    start = pc()
+
+    weight = np.asarray(w, dtype=float)[I]
+    A = od.IndexedCoverageMatrix(I, J, IJ)
+    nof_x = len(J)
+    open_columns = np.searchsorted(J, already_open)
+    group = np.arange(len(I)) * nof_groups // max(len(I), 1)
+    bounds = np.searchsorted(group, np.arange(nof_groups + 1))
+    tolerance = 1e-6 * max(1, weight.sum())
+
+    M = highspy.Highs()
+    M.setOptionValue('output_flag', trace)
+    M.setOptionValue('mip_rel_gap', mipGap)
+    M.changeObjectiveSense(highspy.ObjSense.kMaximize)
+    coef_x = -1/(max(budget_list)+1) if parsimonious else 0
+    lower_x = np.zeros(nof_x)
+    lower_x[open_columns] = 1
+    M.addCols(nof_x, np.full(nof_x, coef_x), lower_x, np.ones(nof_x),
+              0, [], [], [])
+    M.addCols(nof_groups, np.ones(nof_groups), np.zeros(nof_groups),
+              np.bincount(group, weight, nof_groups), 0, [], [], [])
+    M.addRow(-highspy.kHighsInf, 0, nof_x, np.arange(nof_x),
+             np.ones(nof_x))
+    columns = np.arange(nof_x, dtype=np.int32)
+
+    def SetIntegrality(integer):
+        kind = highspy.HighsVarType.kInteger if integer \
+            else highspy.HighsVarType.kContinuous
+        M.changeColsIntegrality(nof_x, columns, np.full(nof_x, kind))
+
+    def AddViolatedCuts(x, theta):
+        cover = A @ x
+        once = cover <= 1 + 1e-6
+        added = 0
+        for k in range(nof_groups):
+            rows = slice(bounds[k], bounds[k+1])
+            in_group = once[rows]
+            constant = weight[rows][~in_group].sum()
+            coefficients = A[rows][in_group].T @ weight[rows][in_group]
+            if theta[k] > constant + coefficients @ x + tolerance:
+                nonzero = np.flatnonzero(coefficients)
+                M.addRow(-highspy.kHighsInf, constant, len(nonzero) + 1,
+                         np.concatenate([[nof_x + k], nonzero]),
+                         np.concatenate([[1], -coefficients[nonzero]]))
+                added += 1
+        return added
+
+    def Value(x):
+        return weight[A @ x > .5].sum()
+
+    def GroupValues(x):
+        return np.bincount(group, np.where(A @ x > .5, weight, 0),
+                           nof_groups)
+
+    greedy = GreedyOpenings(A, weight, open_columns,
+                            min(max(budget_list), nof_x))
+
+    best_x = None
+    nof_cuts = M.getNumRow() - 1
+    for p in progress(budget_list):
+        M.changeRowBounds(0, -highspy.kHighsInf, p + len(already_open))
+        modeling = pc()-start
+        start = pc()
+
+        x = np.zeros(nof_x)
+        x[open_columns] = 1
+        x[greedy[:p]] = 1
+        if best_x is not None and best_x.sum() <= p + len(already_open) \
+                and Value(best_x) > Value(x):
+            x = best_x
+        best_x = x
+
+        def Remaining():
+            return maxTimeInSeconds - (pc() - start)
+
+        SetIntegrality(False)
+        for _ in range(max_lp_rounds):
+            M.setOptionValue('time_limit', max(Remaining(), 0))
+            M.run()
+            solution = np.array(M.getSolution().col_value)
+            if not AddViolatedCuts(solution[:nof_x], solution[nof_x:]):
+                break
+
+        SetIntegrality(True)
+        while True:
+            start_solution = highspy.HighsSolution()
+            start_solution.col_value = list(np.concatenate(
+                [best_x, GroupValues(best_x)]))
+            M.setSolution(start_solution)
+            M.setOptionValue('time_limit', max(Remaining(), 0))
+            M.run()
+            status = M.getModelStatus()
+            upper = M.getInfo().mip_dual_bound
+            solution = np.array(M.getSolution().col_value)
+            if len(solution) < nof_x + nof_groups:
+                termination = M.modelStatusToString(status).lower()
+                break
+            x = np.round(solution[:nof_x])
+            if Value(x) + coef_x * x.sum() \
+                    > Value(best_x) + coef_x * best_x.sum():
+                best_x = x
+            if not AddViolatedCuts(x, solution[nof_x:]):
+                termination = M.modelStatusToString(status).lower()
+                break
+            if Remaining() <= 0:
+                termination = 'time limit'
+                break
+
+        result[p] = dict(
+            modeling=modeling,
+            solving=pc()-start,
+            value=Value(best_x),
+            solution=[J[c] for c in np.flatnonzero(best_x > .5)],
+            termination=termination,
+            upper=upper,
+            cuts=M.getNumRow() - 1 - nof_cuts)
+        nof_cuts = M.getNumRow() - 1
+        start = pc()
+
+    return result
+
+
+def OptimizeAggregated(optimize: callable, w: list, I: list,  # noqa: E741
+                       J: list, IJ: dict, budget_list: list, **kwargs) \
+                           -> dict[int, dict[str, any]]:
+    """
+    Solves with optimize, any of the OptimizeWith functions, the model in
+    which the households that reach the same facilities are merged, see
+    od.AggregateHouseholds, and expands the solutions back to the original
+    households.
+
+    Parameters
+    ----------
+    optimize : callable
+        The solver, e.g. OptimizeWithPyomo or OptimizeWithGurobipy.
+    w : list
+        List of sizes of each household.
+    I : list
+        List of indices of households.
+    J : list
+        List of indices if (potential) locations.
+    IJ : dict
+        Dictionary of households to the locations within reach.
+    budget_list : list
+        List of budgets to optimize for.
+    **kwargs
+        Further arguments of optimize.
+
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        The result of optimize, the 'modeling' time of the first budget
+        includes the merging, with 'served', the households covered by the
+        solution, and 'rows', the number of households before and after
+        merging.
+    """
+    start = pc()
+    w_merged, I_merged, IJ_merged, group = od.AggregateHouseholds(w, I, IJ)
+    households = np.array([i for i in I if i in IJ])
+    aggregating = pc() - start
+
+    result = optimize(w_merged, I_merged, J, IJ_merged, budget_list, **kwargs)
+
+    J = sorted(set(J) | set(kwargs.get('already_open', [])))
+    A = od.IndexedCoverageMatrix(I_merged, J, IJ_merged)
+    for p in budget_list:
+        covered = A @ np.isin(J, result[p]['solution']).astype(float) > 0
+        result[p]['served'] = households[covered[group]]
+        result[p]['rows'] = (len(households), len(I_merged))
+    result[budget_list[0]]['modeling'] += aggregating
+
+    return result
+
+
+def SolveComponent(optimize: callable, w: np.ndarray, J: list, IJ: dict,
+                   budget_list: list, kwargs: dict) -> tuple:
+    """
+    Solves one component for budget_list, on households numbered from 0 as
+    the keys of IJ, returning for each budget the coverage, the solution,
+    the upper bound, the modeling and solving times and the termination.
+    """
+    I = np.arange(len(w))  # noqa: E741
+    result = optimize(w, I, J, IJ, budget_list, **kwargs)
+    J = sorted(set(J) | set(kwargs.get('already_open', [])))
+    A = od.IndexedCoverageMatrix(I, J, IJ)
+    return {p: (w @ (A @ np.isin(J, r['solution']).astype(float) > 0),
+                r['solution'], r.get('upper', np.nan), r['modeling'],
+                r['solving'], r['termination'])
+            for p, r in result.items()}
+
+
+def OptimizeByComponents(optimize: callable, w: list,
+                         I: list, J: list,  # noqa: E741
+                         IJ: dict, budget_list: list,
+                         nof_workers: int = None, **kwargs) \
+                             -> dict[int, dict[str, any]]:
+    """
+    Splits the instance in its connected components, see
+    od.CoverageComponents, solves the coverage versus budget curve of each
+    component with optimize, in parallel, and combines the curves exactly
+    with a knapsack dynamic program over the budget.
+
+    Parameters
+    ----------
+    optimize : callable
+        The solver, e.g. OptimizeWithPyomo or OptimizeWithHighs, a function
+        defined at module level so that it can be sent to the workers.
+    w : list
+        List of sizes of each household.
+    I : list
+        List of indices of households.
+    J : list
+        List of indices if (potential) locations.
+    IJ : dict
+        Dictionary of households to the locations within reach.
+    budget_list : list
+        List of budgets to optimize for.
+    nof_workers : int, optional
+        Number of processes, 1 solves in this process (default is the number
+        of cpus).
+    **kwargs
+        Further arguments of optimize, already_open is split by component.
+
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts with the 'value', 'solution', 'modeling' and 'solving'
+        (summed over the component solves), 'termination' (optimal if all
+        component solves were), 'upper' (the same program on the upper bounds
+        of the components) and 'components' for each budget.
+    """
+    w = np.asarray(w)
+    already_open = kwargs.pop('already_open', [])
+    max_budget = max(budget_list)
+    nof_workers = nof_workers or os.cpu_count()
+
+    tasks = []
+    for households, facilities in od.CoverageComponents(
+            I, np.union1d(J, already_open), IJ):
+        opened = [j for j in already_open if j in set(facilities)]
+        budgets = list(range(min(max_budget, len(facilities) - len(opened))
+                             + 1))
+        local_IJ = {r: IJ[i] for r, i in enumerate(households)}
+        tasks.append((optimize, w[households], list(facilities), local_IJ,
+                      budgets, dict(kwargs, already_open=opened)))
+
+    if nof_workers == 1:
+        curves = [SolveComponent(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(nof_workers) as pool:
+            curves = list(pool.map(SolveComponent, *zip(*tasks)))
+
+    # best[b] the value of budget b over the components so far, choice[c][b]
+    # the budget of component c in it
+    best = np.zeros(max_budget + 1)
+    upper = np.zeros(max_budget + 1)
+    choice = []
+    for curve in curves:
+        values = np.array([curve[b][0] for b in sorted(curve)])
+        uppers = np.array([curve[b][2] for b in sorted(curve)], dtype=float)
+        candidates = np.full((len(values), max_budget + 1), -np.inf)
+        upper_candidates = np.full((len(values), max_budget + 1), -np.inf)
+        for b in range(len(values)):
+            candidates[b, b:] = best[:max_budget + 1 - b] + values[b]
+            upper_candidates[b, b:] = upper[:max_budget + 1 - b] + uppers[b]
+        choice.append(np.argmax(candidates, axis=0))
+        best = candidates.max(axis=0)
+        upper = upper_candidates.max(axis=0)
+
+    modeling = sum(r[3] for curve in curves for r in curve.values())
+    solving = sum(r[4] for curve in curves for r in curve.values())
+    optimal = all(str(r[5]).endswith('optimal')
+                  for curve in curves for r in curve.values())
+    # facilities already open that serve no household
+    unused = [j for j in already_open
+              if not any(j in task[2] for task in tasks)]
+    result = dict()
+    for p in budget_list:
+        solution, b = list(unused), p
+        for curve, chosen in reversed(list(zip(curves, choice))):
+            solution += list(curve[chosen[b]][1])
+            b -= chosen[b]
+        result[p] = dict(modeling=modeling,
+                         solving=solving,
+                         value=best[p],
+                         solution=sorted(solution),
+                         termination='optimal' if optimal else 'feasible',
+                         upper=upper[p],
+                         components=len(curves))
+
+    return result
+
+
 # Heuristics
+def GreedyGains(A: sp.csc_matrix, w: np.ndarray,
+                coverage: np.ndarray) -> np.ndarray:
+    """
+    Computes the gain of opening each facility, the weight of the households
+    in its catchment area that are not yet covered, with one sparse matrix
+    vector product.
+
+    Parameters
+    ----------
+    A : sparse.csc_matrix
+        Coverage matrix of households by facilities, see od.CoverageMatrix.
+    w : np.ndarray
+        Weight of each household.
+    coverage : np.ndarray
+        Number of open facilities covering each household.
+    Returns
+    -------
+    gains : np.ndarray
+        The gain of each facility (column of A).
+    """
+    return A.T @ np.where(coverage == 0, w, 0)
+
+
+def UpdateGreedyGains(gains: np.ndarray, A_rows: sp.csr_matrix,
+                      w: np.ndarray, newly_covered: np.ndarray) -> None:
+    """
+    Updates in place the gains after opening a facility, subtracting the
+    weight of the newly covered households from the facilities covering
+    them. Only the rows of the newly covered households are touched.
+
+    Parameters
+    ----------
+    gains : np.ndarray
+        The gains to update, see GreedyGains.
+    A_rows : sparse.csr_matrix
+        Coverage matrix in CSR format.
+    w : np.ndarray
+        Weight of each household.
+    newly_covered : np.ndarray
+        Indices of the households covered by the opened facility only.
+    """
+    if len(newly_covered):
+        gains -= A_rows[newly_covered].T @ w[newly_covered]
+
+
+def OpenGreedily(gains: np.ndarray, A: sp.csc_matrix,
+                 A_rows: sp.csr_matrix, w: np.ndarray,
+                 coverage: np.ndarray, solution: list, increments: list,
+                 nof_open: int, alpha: float = 0,
+                 rng: np.random.Generator = None) -> None:
+    """
+    Greedily opens facilities, updating gains, coverage, solution and
+    increments in place, until nof_open facilities are open or no facility
+    increases coverage. Ties are broken by the smallest index.
+
+    With alpha > 0 the facility is drawn uniformly by rng from the restricted
+    candidate list of those with a positive gain of at least
+    max - alpha * (max - min) of the positive gains, as in GRASP.
+    """
+    while len(solution) < nof_open:
+        select = int(np.argmax(gains))
+        if gains[select] <= 0:
+            break
+        if alpha > 0:
+            positive = np.flatnonzero(gains > 0)
+            threshold = gains[select] \
+                - alpha * (gains[select] - gains[positive].min())
+            select = int(rng.choice(positive[gains[positive] >= threshold]))
+        rs = A.indices[A.indptr[select]:A.indptr[select+1]]
+        UpdateGreedyGains(gains, A_rows, w, rs[coverage[rs] == 0])
+        coverage[rs] += 1
+        solution.append(select)
+        increments.append(w[rs[coverage[rs] == 1]].sum())
+
+
+def GreedyOpenings(A: sp.csr_matrix, weight: np.ndarray,
+                   open_columns: list, nof_open: int) -> list:
+    """
+    The columns of A greedily opened, in order, on top of open_columns, up
+    to nof_open or until no column increases coverage. Since greedy is
+    nested, the first p are the greedy openings for budget p. Used to start
+    the solvers.
+    """
+    A_columns = A.tocsc()
+    coverage = SolutionCoverage(A_columns, open_columns)
+    openings = []
+    OpenGreedily(GreedyGains(A_columns, weight, coverage), A_columns, A,
+                 weight, coverage, openings, [], nof_open)
+    return openings
+
+
 def Greedy(w: np.ndarray, IJ: dict, JI: dict, nof_facilities: np.uint,
-           budget_list: list, progress: callable = lambda iterable: iterable) \
+           budget_list: list, progress: callable = lambda iterable: iterable,
+           lazy: bool = True, sparse: bool = False) \
                -> dict[int, dict[str, any]]:
     """
     Fleur's Greedy algorithm for the weighted budgeted maximal covering
@@ -359,6 +1419,19 @@ def Greedy(w: np.ndarray, IJ: dict, JI: dict, nof_facilities: np.uint,
     progress : callable, optional
         Callable (function) to use for progress tracking (default is the
         identity).
+    lazy : bool, optional
+        Whether to use lazy evaluation (CELF) of the gains (default is True).
+        Since coverage is submodular, the gain of a facility computed in an
+        earlier iteration is an upper bound of its current gain. Bounds are
+        kept in a max-heap and only the top one is re-evaluated, until the
+        top is up to date. Gives the same result as the eager evaluation,
+        including ties broken by the smallest index.
+    sparse : bool, optional
+        Whether to compute the gains of all facilities at once on the sparse
+        coverage matrix and update them incrementally, see GreedyGains and
+        UpdateGreedyGains (default is False, lazy is then ignored). Gains are
+        not truncated to int, so with fractional weights ties may be broken
+        differently than with the other evaluations.
     Returns
     -------
     result : dict[int, dict[str, any]]
@@ -372,6 +1445,53 @@ def Greedy(w: np.ndarray, IJ: dict, JI: dict, nof_facilities: np.uint,
 
     nof_households = len(w)
     coverage = np.zeros(nof_households, dtype=np.uint16)
+
+    if sparse:
+        A = od.CoverageMatrix(JI, nof_households, nof_facilities)
+        A_rows = A.tocsr()
+        gains = GreedyGains(A, w, coverage)
+        for p in progress(sorted(budget_list)):
+            OpenGreedily(gains, A, A_rows, w, coverage, greedy_selected,
+                         greedy_added, min(p, nof_facilities))
+            result[p] = dict(solving=pc()-start,
+                             value=sum(greedy_added),
+                             solution=greedy_selected.copy(),
+                             increments=greedy_added.copy(),
+                             coverage=coverage.copy())
+            start = pc()
+
+        return result
+
+    if lazy:
+        # (minus gain, facility, nof selected when computed), gains are
+        # truncated to int as in the eager greedy_val array
+        heap = [(-int(w[JI[j]].sum()), j, 0) for j in JI.keys()]
+        heapq.heapify(heap)
+        for p in progress(sorted(budget_list)):
+            while len(greedy_selected) < min(p, nof_facilities) and heap:
+                minus_gain, select, computed = heap[0]
+                if computed < len(greedy_selected):
+                    rs = JI[select]
+                    gain = int(w[rs[coverage[rs] == 0]].sum())
+                    heapq.heapreplace(heap,
+                                      (-gain, select, len(greedy_selected)))
+                    continue
+                if minus_gain >= 0:
+                    break
+                heapq.heappop(heap)
+                coverage[JI[select]] += 1
+                greedy_selected.append(select)
+                greedy_added.append(-minus_gain)
+
+            result[p] = dict(solving=pc()-start,
+                             value=sum(greedy_added),
+                             solution=greedy_selected.copy(),
+                             increments=greedy_added.copy(),
+                             coverage=coverage.copy())
+            start = pc()
+
+        return result
+
     greedy_val = -np.ones(nof_facilities, dtype=int)
 
     may_change = np.array(list(JI.keys()))
@@ -402,14 +1522,53 @@ def Greedy(w: np.ndarray, IJ: dict, JI: dict, nof_facilities: np.uint,
     return result
 
 
+def UpdateCoverageTables(rows: np.ndarray, step: int, coverage: np.ndarray,
+                         gains: np.ndarray, ones: np.ndarray,
+                         A_rows: sp.csr_matrix, w: np.ndarray) -> None:
+    """
+    Opens (step 1) or closes (step -1) a facility with catchment area rows,
+    updating in place the coverage and, for every facility, the weight of the
+    households in its catchment area covered zero (gains) and exactly one
+    (ones) times. Only the rows whose coverage count crosses 0, 1 or 2 are
+    touched.
+    """
+    def Weight(idx):
+        return A_rows[idx].T @ w[idx]
+
+    before = coverage[rows]
+    if step > 0:
+        newly = rows[before == 0]
+        if len(newly):
+            weight = Weight(newly)
+            gains -= weight
+            ones += weight
+        ones -= Weight(rows[before == 1])
+    else:
+        uncovered = rows[before == 1]
+        if len(uncovered):
+            weight = Weight(uncovered)
+            gains += weight
+            ones -= weight
+        ones += Weight(rows[before == 2])
+    coverage[rows] = before + step
+
+
 def LocalSearch(solution: list, coverage: np.ndarray, objective: int, J: list,
-                JI: dict, household: list) \
+                JI: dict, household: list, improvement: str = 'first',
+                A: sp.csc_matrix = None, patience: int = None) \
                     -> tuple[list, list, int, list, list, float]:
     """
     This function performs a local search algorithm to optimize coverage by
     attempting to swap one open for one closed facility for as long as that
     increases coverage.
 
+    Implements the fast interchange of Whitaker: for each facility we keep
+    the weight of the households in its catchment area that are uncovered
+    (the gain of opening it) and covered once (for an open facility, the
+    loss of closing it). The gain of all candidates replacing an open
+    facility then follows from one sparse product over the households it
+    uniquely covers, and the tables are updated incrementally after a swap.
+
     Parameters
     ----------
     solution : list
@@ -424,6 +1583,17 @@ def LocalSearch(solution: list, coverage: np.ndarray, objective: int, J: list,
         Dictionary of facilities to households.
     household : list
         The headcount of the households.
+    improvement : str, optional
+        'first' to swap each open facility, in turn, for its best replacement
+        as soon as that improves, or 'best' to apply the best swap over all
+        open facilities at each step (default is 'first').
+    A : sp.csc_matrix, optional
+        The coverage matrix, see od.CoverageMatrix, built from JI if None.
+    patience : int, optional
+        If given, the search is 'adaptive': a candidate that failed to
+        improve on patience consecutive attempts is considered hopeless and
+        no longer tried, at the risk of missing a later improvement (default
+        is None, all candidates are always tried).
     Returns
     -------
     sol : list
@@ -439,37 +1609,86 @@ def LocalSearch(solution: list, coverage: np.ndarray, objective: int, J: list,
     final_time : float
         The total time taken to reach the optimized solution.
     """
+    if improvement not in ('first', 'best'):
+        raise ValueError(f'Unknown improvement {improvement}')
 
     sol = copy.copy(solution)
     cov = copy.copy(coverage)
     obj = objective
     times, objectives = [0], [obj]
 
-    candidates = np.setdiff1d(J, sol, assume_unique=True)
-
     start = pc()
-    while True:
-        modified = False
-        for i in range(len(sol)):
-            rsi = JI[sol[i]]
-            hh_out = household[rsi[cov[rsi] == 1]].sum()
-            cov[rsi] -= 1
-            for j in range(len(candidates)):
-                rcj = JI[candidates[j]]
-                hh_in = household[rcj[cov[rcj] == 0]].sum()
-                if hh_in > hh_out:
-                    cov[rcj] += 1
-                    obj += hh_in - hh_out
-                    hh_out = hh_in
-                    sol[i], candidates[j] = candidates[j], sol[i]
+    household = np.asarray(household)
+    if A is None:
+        A = od.CoverageMatrix(JI, len(household))
+    A_rows = A.tocsr()
+    nof_columns = A.shape[1]
+
+    def Rows(j):
+        return A.indices[A.indptr[j]:A.indptr[j+1]]
+
+    closed = np.zeros(nof_columns, dtype=bool)
+    closed[np.asarray(J, dtype=np.int64)] = True
+    closed[np.asarray(sol, dtype=np.int64)] = False
+    # consecutive failed attempts of each candidate, for the adaptive search
+    failures = np.zeros(nof_columns, dtype=int)
+    if not len(sol) or not closed.any():
+        final_time = pc() - start
+        times.append(final_time), objectives.append(obj)
+        return sol, obj, cov, objectives, times, final_time
+
+    gains = A.T @ np.where(cov == 0, household, 0)
+    ones = A.T @ np.where(cov == 1, household, 0)
+    # guards against cycling on rounding errors of fractional weights
+    tolerance = 1e-9 * np.abs(household).sum() \
+        if np.issubdtype(household.dtype, np.floating) else 0
+
+    def BestSwap(i):
+        # gains of all candidates once sol[i] is closed, minus its loss
+        rsi = Rows(sol[i])
+        unique = rsi[cov[rsi] == 1]
+        swap_in = gains + A_rows[unique].T @ household[unique] \
+            if len(unique) else gains
+        candidates = np.flatnonzero(closed)
+        if patience is not None:
+            candidates = candidates[failures[candidates] < patience]
+            if not len(candidates):
+                return 0, -1
+            failing = swap_in[candidates] - ones[sol[i]] <= tolerance
+            failures[candidates] = np.where(failing,
+                                            failures[candidates] + 1, 0)
+        j = int(candidates[np.argmax(swap_in[candidates])])
+        return swap_in[j] - ones[sol[i]], j
+
+    def Swap(i, j, delta):
+        nonlocal obj
+        UpdateCoverageTables(Rows(sol[i]), -1, cov, gains, ones, A_rows,
+                             household)
+        UpdateCoverageTables(Rows(j), 1, cov, gains, ones, A_rows, household)
+        closed[sol[i]], closed[j] = True, False
+        failures[sol[i]] = 0
+        sol[i] = j
+        obj += delta
+        times.append(pc() - start)
+        objectives.append(obj)
+
+    if improvement == 'first':
+        modified = True
+        while modified:
+            modified = False
+            for i in range(len(sol)):
+                delta, j = BestSwap(i)
+                if delta > tolerance:
+                    Swap(i, j, delta)
                     modified = True
-                    rsi = JI[sol[i]]
-                    cov[rsi] -= 1
-                    times.append(pc() - start)
-                    objectives.append(obj)
-            cov[rsi] += 1
-        if not modified:
-            break
+    else:
+        while True:
+            swaps = [BestSwap(i) for i in range(len(sol))]
+            i = max(range(len(sol)), key=lambda i: swaps[i][0])
+            delta, j = swaps[i]
+            if delta <= tolerance:
+                break
+            Swap(i, j, delta)
 
     final_time = pc() - start
     times.append(final_time), objectives.append(obj)
@@ -482,7 +1701,8 @@ def GreedyLS(w: np.ndarray,
              JI: dict,
              nof_facilities: np.uint,
              budget_list: list,
-             progress: callable = lambda iterable: iterable
+             progress: callable = lambda iterable: iterable,
+             improvement: str = 'first'
              ) -> dict[int, dict[str, any]]:
 
     """
@@ -505,6 +1725,9 @@ def GreedyLS(w: np.ndarray,
     progress : callable, optional
         Callable (function) to use for progress tracking (default is the
         identity).
+    improvement : str, optional
+        The improvement strategy of LocalSearch, 'first' or 'best' (default
+        is 'first').
     Returns
     -------
     result : dict[int, dict[str, any]]
@@ -519,45 +1742,762 @@ def GreedyLS(w: np.ndarray,
             coverage[JI[j]] += 1
         return coverage
 
-    def GetSolutionValue(solution, household, JI):
-        if solution:
-            return household[od.all_in([JI[s] for s in solution])].sum()
-        return 0
-
     result = dict()
     start = pc()
     solution, greedy_added = [], []
 
     nof_households = len(w)
     coverage = np.zeros(nof_households, dtype=np.uint16)
-    greedy_val = -np.ones(nof_facilities, dtype=int)
+    A = od.CoverageMatrix(JI, nof_households, nof_facilities)
+    A_rows = A.tocsr()
 
     J = list(JI.keys())
 
-    i = prev = -1
     for p in progress(sorted(budget_list)):
-        may_change = np.array(J)
-        for i in range(prev+1, min(p, nof_facilities)):
-            greedy_val[may_change] = [w[JI[j][coverage[JI[j]] == 0]].sum()
-                                      for j in may_change]
-            select = np.argmax(greedy_val)
-            if greedy_val[select] <= 0:
-                break
-
-            coverage[JI[select]] += 1
-            solution.append(select)
-            greedy_added.append(greedy_val[select])
-
-            # Greedy only changes if coverage overlap with selected facility
-            may_change = np.unique(np.concatenate([IJ[i] for i in JI[select]]))
-        prev = i
+        # the local search changes the coverage, so gains start afresh
+        gains = GreedyGains(A, w, coverage)
+        OpenGreedily(gains, A, A_rows, w, coverage, solution, greedy_added,
+                     min(p, nof_facilities))
 
         solution, objective, coverage, *_ = \
             LocalSearch(solution, coverage,
-                        GetSolutionValue(solution, w, JI), J, JI, w)
+                        w[coverage > 0].sum(), J, JI, w,
+                        improvement, A)
 
         result[p] = dict(solving=pc()-start, value=objective,
                          solution=solution, coverage=coverage)
         start = pc()
 
     return result
+
+
+def SolutionCoverage(A: sp.csc_matrix, solution: list) -> np.ndarray:
+    """
+    Number of facilities of solution covering each household.
+    """
+    return np.asarray(A[:, solution].sum(axis=1)).ravel().astype(np.uint16)
+
+
+def EvaluateSolutions(bits: np.ndarray, w: np.ndarray, solutions: list,
+                      max_bytes: int = 2**26) -> np.ndarray:
+    """
+    Coverage of each of the solutions, lists of facility columns, from the
+    packed coverage bits, see od.PackCoverage, a batch of the unions of
+    about max_bytes at a time.
+    """
+    batch_size = max(1, max_bytes // max(1, bits.shape[1] * 8))
+    return np.concatenate([
+        od.WeightedPopcount(
+            od.SolutionBits(bits, solutions[b:b + batch_size]), w)
+        for b in range(0, len(solutions), batch_size)
+    ] or [np.zeros(0, dtype=np.asarray(w).dtype)])
+
+
+def AdditionGains(bits: np.ndarray, w: np.ndarray,
+                  solution: list) -> np.ndarray:
+    """
+    Coverage gained by adding each facility to solution, for all facilities
+    at once, from the packed coverage bits, see od.PackCoverage.
+    """
+    uncovered = ~od.SolutionBits(bits, [solution])[0]
+    return od.WeightedPopcount(bits & uncovered, w)
+
+
+def AddToPool(pool: list, entry: tuple, pool_size: int) -> None:
+    """
+    Adds in place entry, a tuple starting with the value and ending with the
+    solution, to the pool of the pool_size best distinct solutions, sorted
+    by decreasing value. Entries compare by all but the solution, ties
+    keep the entry already in the pool.
+    """
+    if any(set(e[-1]) == set(entry[-1]) for e in pool):
+        return
+    pool.append(entry)
+    pool.sort(key=lambda e: e[:-1], reverse=True)
+    del pool[pool_size:]
+
+
+def GRASPStart(w: np.ndarray, A: sp.csc_matrix, budget_list: list,
+               alpha: float, seed: np.random.SeedSequence,
+               improvement: str = 'first') -> dict[int, tuple]:
+    """
+    One start of GRASP: for each budget, in increasing order, extends the
+    previous solution with a randomized greedy construction and improves it
+    with LocalSearch.
+
+    Parameters
+    ----------
+    w : np.ndarray
+        Weight of each household.
+    A : sp.csc_matrix
+        Coverage matrix, see od.CoverageMatrix.
+    budget_list : list
+        List of budgets.
+    alpha : float
+        Greediness of the restricted candidate list, 0 is greedy and 1 is
+        any facility with a positive gain, see OpenGreedily.
+    seed : np.random.SeedSequence
+        Seed of the random generator of this start.
+    improvement : str, optional
+        The improvement strategy of LocalSearch (default is 'first').
+    Returns
+    -------
+    found : dict[int, tuple]
+        The value and solution for each budget.
+    """
+    rng = np.random.default_rng(seed)
+    A_rows = A.tocsr()
+    J = np.flatnonzero(np.diff(A.indptr))
+    coverage = np.zeros(len(w), dtype=np.uint16)
+    solution, increments, found = [], [], dict()
+    for p in sorted(budget_list):
+        gains = GreedyGains(A, w, coverage)
+        OpenGreedily(gains, A, A_rows, w, coverage, solution, increments,
+                     min(p, len(J)), alpha, rng)
+        solution, value, coverage, *_ = \
+            LocalSearch(solution, coverage, w[coverage > 0].sum(), J, None,
+                        w, improvement, A)
+        found[p] = (value, solution.copy())
+    return found
+
+
+# data shared by the starts of GRASP running in a worker process
+_grasp_data = dict()
+
+
+def _GRASPWorkerInit(w: np.ndarray, A: sp.csc_matrix) -> None:
+    _grasp_data.update(w=w, A=A)
+
+
+def _GRASPWorkerStart(*args) -> dict[int, tuple]:
+    return GRASPStart(_grasp_data['w'], _grasp_data['A'], *args)
+
+
+def GRASP(w: np.ndarray,
+          IJ: dict,
+          JI: dict,
+          nof_facilities: np.uint,
+          budget_list: list,
+          alpha: float = 0.2,
+          max_starts: int = 100,
+          max_seconds: float = None,
+          nof_workers: int = None,
+          seed: int = 0,
+          improvement: str = 'first',
+          elite_size: int = 1,
+          callback: callable = None,
+          cancelled: callable = None
+          ) -> dict[int, dict[str, any]]:
+    """
+    GRASP (Greedy Randomized Adaptive Search Procedure) as in the thesis of
+    Fleur Theulen: repeated randomized greedy constructions, each followed
+    by LocalSearch, keeping the best solution found for each budget.
+
+    Starts are independent and run in a pool of nof_workers processes, each
+    with its own random generator spawned from seed, so that the result for
+    a given max_starts does not depend on the number of workers.
+
+    Parameters
+    ----------
+    w : np.ndarray
+        Weight matrix.
+    IJ : dict
+        Dictionary of households to facilities (not used, kept for the
+        signature of Greedy).
+    JI : dict
+        Dictionary of facilities to households.
+    nof_facilities : np.uint
+        Number of facilities.
+    budget_list : list
+        List of budgets.
+    alpha : float, optional
+        Greediness of the restricted candidate list, see OpenGreedily
+        (default is 0.2).
+    max_starts : int, optional
+        Maximum number of starts, None for no limit (default is 100).
+    max_seconds : float, optional
+        No new starts after this many seconds, None for no limit (default is
+        None). At least one start is always made.
+    nof_workers : int, optional
+        Number of processes, 1 runs in this process (default is the number
+        of cpus).
+    seed : int, optional
+        Seed of the random generators (default is 0).
+    improvement : str, optional
+        The improvement strategy of LocalSearch (default is 'first').
+    elite_size : int, optional
+        Number of best distinct solutions kept per budget (default is 1).
+    callback : callable, optional
+        Called as callback(p, update) with the 'value' and 'solution' of each
+        improvement for budget p, and with the results at the end. Returning
+        True makes no new starts (default is None).
+    cancelled : callable, optional
+        Checked before every start, returning True makes no new starts and
+        drops those not yet running (default is None).
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts containing the 'value', 'solution', 'solving',
+        'coverage', 'starts' and 'elite', the list of (value, solution) of
+        the best distinct solutions, for each budget.
+    """
+    if max_starts is None and max_seconds is None:
+        raise ValueError('GRASP needs max_starts or max_seconds')
+
+    start = pc()
+    deadline = start + max_seconds if max_seconds is not None else np.inf
+    nof_workers = nof_workers or os.cpu_count()
+
+    w = np.asarray(w)
+    A = od.CoverageMatrix(JI, len(w), nof_facilities)
+    budget_list = sorted(budget_list)
+    seeds = np.random.SeedSequence(seed)
+
+    # best (value, -start, solution) per budget, ties to the earliest start
+    elite = {p: [] for p in budget_list}
+    nof_starts = 0
+    stop = False
+
+    def Keep(index, found):
+        nonlocal stop
+        for p, (value, solution) in found.items():
+            AddToPool(elite[p], (value, -index, solution), elite_size)
+            if callback and elite[p][0][1] == -index:
+                stop |= bool(callback(p, dict(value=value,
+                                              solution=solution)))
+
+    def MoreStarts():
+        nonlocal stop
+        stop |= bool(cancelled and cancelled())
+        return nof_starts == 0 or (
+            (max_starts is None or nof_starts < max_starts)
+            and pc() < deadline and not stop)
+
+    if nof_workers == 1:
+        while MoreStarts():
+            Keep(nof_starts, GRASPStart(w, A, budget_list, alpha,
+                                        seeds.spawn(1)[0], improvement))
+            nof_starts += 1
+    else:
+        with ProcessPoolExecutor(nof_workers, initializer=_GRASPWorkerInit,
+                                 initargs=(w, A)) as pool:
+            pending = dict()
+            while True:
+                while MoreStarts() and len(pending) < 2 * nof_workers:
+                    future = pool.submit(_GRASPWorkerStart, budget_list,
+                                         alpha, seeds.spawn(1)[0],
+                                         improvement)
+                    pending[future] = nof_starts
+                    nof_starts += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    Keep(pending.pop(future), future.result())
+                if not MoreStarts():
+                    for future in [f for f in pending if f.cancel()]:
+                        del pending[future]
+
+    solving = pc() - start
+    result = dict()
+    for p in budget_list:
+        value, _, solution = elite[p][0]
+        result[p] = dict(solving=solving, value=value, solution=solution,
+                         coverage=SolutionCoverage(A, solution),
+                         starts=nof_starts,
+                         elite=[(v, s) for v, _, s in elite[p]])
+        if callback:
+            callback(p, result[p])
+
+    return result
+
+
+def PathRelinking(w: np.ndarray, A: sp.csc_matrix, initiating: list,
+                  guiding: list, improvement: str = 'first',
+                  patience: int = None) -> tuple:
+    """
+    Walks from the initiating to the guiding solution, at each step making
+    the best swap of a facility only in initiating for one only in
+    guiding, and improves the best intermediate solution with LocalSearch.
+
+    Parameters
+    ----------
+    w : np.ndarray
+        Weight of each household.
+    A : sp.csc_matrix
+        Coverage matrix, see od.CoverageMatrix.
+    initiating : list
+        The solution to start from.
+    guiding : list
+        The solution to walk to.
+    improvement : str, optional
+        The improvement strategy of LocalSearch (default is 'first').
+    patience : int, optional
+        The patience of LocalSearch (default is None).
+    Returns
+    -------
+    found : tuple
+        The value and solution found, None if the solutions differ in less
+        than two facilities, so that there is no intermediate solution.
+    """
+    A_rows = A.tocsr()
+    sol = list(initiating)
+    leaving = [j for j in sol if j not in set(guiding)]
+    entering = [j for j in guiding if j not in set(sol)]
+    if min(len(leaving), len(entering)) < 2:
+        return None
+
+    cov = SolutionCoverage(A, sol)
+    gains = A.T @ np.where(cov == 0, w, 0)
+    ones = A.T @ np.where(cov == 1, w, 0)
+    value = w[cov > 0].sum()
+    best = None
+
+    def Rows(j):
+        return A.indices[A.indptr[j]:A.indptr[j+1]]
+
+    # stop one swap before reaching guiding
+    while min(len(leaving), len(entering)) > 1:
+        moves = []
+        for s in leaving:
+            rs = Rows(s)
+            unique = rs[cov[rs] == 1]
+            swap_in = gains[entering] - ones[s]
+            if len(unique):
+                swap_in = swap_in \
+                    + (A_rows[unique].T @ w[unique])[entering]
+            c = int(np.argmax(swap_in))
+            moves.append((swap_in[c], s, entering[c]))
+        delta, s, c = max(moves, key=lambda m: m[0])
+        UpdateCoverageTables(Rows(s), -1, cov, gains, ones, A_rows, w)
+        UpdateCoverageTables(Rows(c), 1, cov, gains, ones, A_rows, w)
+        sol[sol.index(s)] = c
+        leaving.remove(s), entering.remove(c)
+        value += delta
+        if best is None or value > best[0]:
+            best = (value, sol.copy(), cov.copy())
+
+    value, sol, cov = best
+    sol, value, *_ = LocalSearch(sol, cov, value, np.flatnonzero(
+        np.diff(A.indptr)), None, w, improvement, A, patience)
+    return value, sol
+
+
+def GreedyStage(w: np.ndarray, A: sp.csc_matrix, budget_list: list,
+                pool: dict, pool_size: int) -> None:
+    """
+    Adds the solutions of the sparse Greedy to the pool.
+    """
+    A_rows = A.tocsr()
+    coverage = np.zeros(len(w), dtype=np.uint16)
+    solution, increments = [], []
+    gains = GreedyGains(A, w, coverage)
+    for p in budget_list:
+        OpenGreedily(gains, A, A_rows, w, coverage, solution, increments,
+                     min(p, A.shape[1]))
+        AddToPool(pool[p], (w[coverage > 0].sum(), solution.copy()),
+                  pool_size)
+
+
+def GRASPStage(w: np.ndarray, A: sp.csc_matrix, budget_list: list,
+               pool: dict, pool_size: int, **options) -> None:
+    """
+    Adds the elite solutions of GRASP to the pool, options go to GRASP.
+    """
+    JI = {j: A.indices[A.indptr[j]:A.indptr[j+1]] for j in range(A.shape[1])}
+    grasp = GRASP(w, None, JI, A.shape[1], budget_list,
+                  elite_size=pool_size, **options)
+    for p in budget_list:
+        for entry in grasp[p]['elite']:
+            AddToPool(pool[p], entry, pool_size)
+
+
+def LocalSearchStage(w: np.ndarray, A: sp.csc_matrix, budget_list: list,
+                     pool: dict, pool_size: int, improvement: str = 'first',
+                     patience: int = None) -> None:
+    """
+    Improves the solutions of the pool with LocalSearch.
+    """
+    J = np.flatnonzero(np.diff(A.indptr))
+    for p in budget_list:
+        for value, solution in list(pool[p]):
+            solution, value, *_ = LocalSearch(
+                solution, SolutionCoverage(A, solution), value, J, None, w,
+                improvement, A, patience)
+            AddToPool(pool[p], (value, solution), pool_size)
+
+
+def PathRelinkingStage(w: np.ndarray, A: sp.csc_matrix, budget_list: list,
+                       pool: dict, pool_size: int, improvement: str = 'first',
+                       patience: int = None) -> None:
+    """
+    Relinks every ordered pair of solutions of the pool, see PathRelinking,
+    adding the solutions found to the pool.
+    """
+    for p in budget_list:
+        elite = [solution for _, solution in pool[p]]
+        for initiating in elite:
+            for guiding in elite:
+                found = PathRelinking(w, A, initiating, guiding, improvement,
+                                      patience)
+                if found is not None:
+                    AddToPool(pool[p], found, pool_size)
+
+
+heuristic_stages = {'greedy': GreedyStage,
+                    'grasp': GRASPStage,
+                    'local_search': LocalSearchStage,
+                    'path_relinking': PathRelinkingStage}
+
+
+def HeuristicPipeline(w: np.ndarray,
+                      IJ: dict,
+                      JI: dict,
+                      nof_facilities: np.uint,
+                      budget_list: list,
+                      stages: list = ('greedy', ('grasp', dict(max_starts=20)),
+                                      'path_relinking'),
+                      pool_size: int = 10,
+                      progress: callable = lambda iterable: iterable
+                      ) -> dict[int, dict[str, any]]:
+    """
+    Runs heuristics as stages sharing, for each budget, a pool of the best
+    distinct solutions found so far.
+
+    Parameters
+    ----------
+    w : np.ndarray
+        Weight matrix.
+    IJ : dict
+        Dictionary of households to facilities (not used, kept for the
+        signature of Greedy).
+    JI : dict
+        Dictionary of facilities to households.
+    nof_facilities : np.uint
+        Number of facilities.
+    budget_list : list
+        List of budgets.
+    stages : list, optional
+        The stages to run in order, each the name of a stage in
+        heuristic_stages or a tuple of a name and a dict of its options
+        (default is greedy, GRASP with 20 starts and path relinking).
+    pool_size : int, optional
+        Number of solutions kept per budget (default is 10).
+    progress : callable, optional
+        Callable (function) to use for progress tracking over the stages
+        (default is the identity).
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts containing the 'value', 'solution', 'solving',
+        'coverage', 'pool' and 'stages', the time taken by each stage, for
+        each budget.
+    """
+    stages = [(stage, dict()) if isinstance(stage, str) else stage
+              for stage in stages]
+    for name, _ in stages:
+        if name not in heuristic_stages:
+            raise ValueError(f'Unknown stage {name}')
+
+    start = pc()
+    w = np.asarray(w)
+    A = od.CoverageMatrix(JI, len(w), nof_facilities)
+    budget_list = sorted(budget_list)
+    pool = {p: [] for p in budget_list}
+    timings = []
+    for name, options in progress(stages):
+        stage_start = pc()
+        heuristic_stages[name](w, A, budget_list, pool, pool_size, **options)
+        timings.append((name, pc() - stage_start))
+
+    solving = pc() - start
+    result = dict()
+    for p in budget_list:
+        value, solution = pool[p][0] if pool[p] else (0, [])
+        result[p] = dict(solving=solving, value=value, solution=solution,
+                         coverage=SolutionCoverage(A, solution),
+                         pool=pool[p].copy(), stages=timings)
+
+    return result
+
+
+# Bounds
+def LagrangianRelaxation(w: np.ndarray,
+                         IJ: dict,
+                         JI: dict,
+                         nof_facilities: np.uint,
+                         budget_list: list,
+                         max_iterations: int = 1000,
+                         max_seconds: float = None,
+                         gap: float = 1e-4,
+                         patience: int = 20,
+                         progress: callable = lambda iterable: iterable,
+                         callback: callable = None,
+                         cancelled: callable = None
+                         ) -> dict[int, dict[str, any]]:
+    """
+    Bounds the weighted maximal covering problem by the Lagrangian
+    relaxation of the serve_if_open constraints Y[i] <= sum(X[j] for j in
+    IJ[i]) with multipliers u[i] >= 0, solved by subgradient optimization.
+
+    For given u the relaxation separates: Y[i] = 1 if w[i] > u[i], and the
+    budget opens the facilities with the largest positive A.T @ u. Its value
+    is an upper bound. The facilities it opens, completed by Greedy up to the
+    budget, are a feasible solution and a lower bound. Multipliers of a
+    budget warm start the next (budgets are solved in increasing order).
+
+    Parameters
+    ----------
+    w : np.ndarray
+        Weight matrix.
+    IJ : dict
+        Dictionary of households to facilities (not used, kept for the
+        signature of Greedy).
+    JI : dict
+        Dictionary of facilities to households.
+    nof_facilities : np.uint
+        Number of facilities.
+    budget_list : list
+        List of budgets.
+    max_iterations : int, optional
+        Maximum number of subgradient iterations per budget (default is
+        1000).
+    max_seconds : float, optional
+        Maximum time in seconds per budget, None for no limit (default is
+        None).
+    gap : float, optional
+        Stops when (upper - value) / upper is at most gap (default is 1e-4).
+    patience : int, optional
+        Halves the step size after this many iterations without improving
+        the upper bound (default is 20).
+    progress : callable, optional
+        Callable (function) to use for progress tracking (default is the
+        identity).
+    callback : callable, optional
+        Called as callback(p, update) when the 'value' and 'solution' or the
+        'upper' bound of budget p improve, and with the result of budget p.
+        Returning True stops, skipping the remaining budgets (default is
+        None).
+    cancelled : callable, optional
+        Checked at every iteration, returning True stops as callback does
+        (default is None).
+    Returns
+    -------
+    result : dict[int, dict[str, any]]
+        dict of dicts containing the 'value', 'upper', 'solution',
+        'coverage', 'modeling', 'solving', 'termination' and 'iterations'
+        for each budget.
+    """
+    result = dict()
+    start = pc()
+
+    w = np.asarray(w)
+    A = od.CoverageMatrix(JI, len(w), nof_facilities)
+    A_rows = A.tocsr()
+    nof_columns = A.shape[1]
+    integer = np.issubdtype(w.dtype, np.integer)
+    u = w.astype(float)
+    modeling = pc() - start
+    stop = False
+
+    for p in progress(sorted(budget_list)):
+        start = pc()
+        nof_open = min(p, nof_columns)
+        best_value, best_solution = -np.inf, []
+        upper = np.inf
+        step, stalled = 2.0, 0
+        termination = 'iteration limit'
+        for iteration in range(1, max_iterations + 1):
+            # solve the relaxation
+            facility_value = A.T @ u
+            opened = np.empty(0, dtype=int)
+            if nof_open:
+                opened = np.argpartition(-facility_value,
+                                         nof_open - 1)[:nof_open]
+            opened = opened[facility_value[opened] > 0]
+            served = w > u
+            bound = (w - u)[served].sum() + facility_value[opened].sum()
+            update = dict()
+            if bound < upper:
+                upper, stalled = bound, 0
+                update.update(upper=np.floor(upper + 1e-9) if integer
+                              else upper)
+            else:
+                stalled += 1
+                if stalled >= patience:
+                    step, stalled = step / 2, 0
+
+            # greedy repair of the facilities opened by the relaxation
+            solution = sorted(opened.tolist())
+            coverage = SolutionCoverage(A, solution)
+            OpenGreedily(GreedyGains(A, w, coverage), A, A_rows, w, coverage,
+                         solution, [], nof_open)
+            value = w[coverage > 0].sum()
+            if value > best_value:
+                best_value, best_solution = value, solution
+                update.update(value=value, solution=solution)
+            if (callback and update and callback(p, update)) \
+                    or (cancelled and cancelled()):
+                stop, termination = True, 'interrupted'
+                break
+
+            effective_upper = np.floor(upper + 1e-9) if integer else upper
+            if effective_upper - best_value <= gap * abs(effective_upper):
+                termination = 'optimal'
+                break
+            if max_seconds is not None and pc() - start > max_seconds:
+                termination = 'time limit'
+                break
+
+            # subgradient of the relaxed constraints, A X - Y
+            subgradient = A[:, opened].sum(axis=1).A1 - served
+            norm = (subgradient ** 2).sum()
+            if norm == 0:
+                # the multipliers minimize the relaxation
+                termination = 'converged'
+                break
+            u = np.clip(u - step * (upper - best_value) / norm * subgradient,
+                        0, w)
+
+        result[p] = dict(modeling=modeling,
+                         solving=pc() - start,
+                         value=best_value,
+                         upper=np.floor(upper + 1e-9) if integer else upper,
+                         solution=best_solution,
+                         coverage=SolutionCoverage(A, best_solution),
+                         termination=termination,
+                         iterations=iteration)
+        if (callback and callback(p, result[p])) or stop:
+            break
+        modeling = 0
+
+    return result
+
+
+# Anytime solving
+class AnytimeSolve:
+    """
+    Runs optimize(*args, callback=..., cancelled=..., **kwargs) in a
+    background thread, for optimize any of OptimizeWithHighs, BudgetCurve,
+    OptimizeWithGurobipy, GRASP and LagrangianRelaxation, keeping the best
+    solution and bound of each budget as the solve goes.
+
+    Example, stopping once budget 10 is within 1% of optimal:
+
+        solve = AnytimeSolve(OptimizeWithHighs, w, I, J, IJ, [10])
+        solve.Subscribe(lambda p, best: best['gap'] <= .01 and solve.Cancel())
+        solve.Start()
+        result = solve.Result()
+
+    Parameters
+    ----------
+    optimize : callable
+        The optimization function, with callback and cancelled arguments.
+    *args, **kwargs
+        The arguments of optimize.
+    """
+
+    def __init__(self, optimize: callable, *args, **kwargs):
+        self.optimize = optimize
+        self.args = args
+        self.kwargs = kwargs
+        self.best = dict()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.result = None
+        self.error = None
+
+    def Run(self) -> None:
+        try:
+            result = self.optimize(*self.args, callback=self.Update,
+                                   cancelled=self.cancelled.is_set,
+                                   **self.kwargs)
+            # BudgetCurve yields its budgets
+            self.result = dict(result) if isinstance(result, Iterator) \
+                else result
+        except Exception as error:
+            self.error = error
+
+    def Update(self, p: int, update: dict) -> bool:
+        """
+        The callback of optimize: merges the update into the best of budget
+        p, notifies the listeners and tells whether to stop.
+        """
+        with self.lock:
+            best = self.best.setdefault(p, dict(
+                value=-np.inf, solution=None, upper=np.inf, gap=np.inf,
+                termination=None))
+            if update.get('value', -np.inf) > best['value'] \
+                    or 'termination' in update:
+                best.update(value=update['value'],
+                            solution=update['solution'])
+            if update.get('upper') is not None:
+                best['upper'] = min(best['upper'], update['upper'])
+            if 'termination' in update:
+                best['termination'] = update['termination']
+            if np.isfinite(best['upper']) and best['upper'] > 0:
+                best['gap'] = (best['upper'] - best['value']) / best['upper']
+            best = dict(best)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(p, best)
+        return self.cancelled.is_set()
+
+    def Start(self) -> 'AnytimeSolve':
+        """
+        Starts the solve.
+        """
+        self.thread.start()
+        return self
+
+    def Subscribe(self, listener: callable) -> None:
+        """
+        Calls listener(p, best) now for each budget p with a solution or bound
+        and then with each update, best a dict of the 'value', 'solution',
+        'upper', 'gap' and, once solved, 'termination' of budget p. Listeners
+        run in the thread of the solve and should be quick.
+        """
+        with self.lock:
+            self.listeners.append(listener)
+            current = {p: dict(best) for p, best in self.best.items()}
+        for p, best in current.items():
+            listener(p, best)
+
+    def Best(self, p: int = None) -> dict:
+        """
+        The current best of budget p, or of all budgets by budget.
+        """
+        with self.lock:
+            if p is not None:
+                return dict(self.best.get(p, dict()))
+            return {p: dict(best) for p, best in self.best.items()}
+
+    def Cancel(self) -> None:
+        """
+        Asks the solve to stop at its next check of cancelled, which ends the
+        current budget with its incumbent and skips the remaining budgets.
+        HiGHS cannot be interrupted while it solves the root LP relaxation of
+        a budget, so OptimizeWithHighs and BudgetCurve may take as long as
+        that solve to stop, seconds on large instances. The incumbent is
+        then at least the greedy solution of the budget.
+        """
+        self.cancelled.set()
+
+    def Done(self) -> bool:
+        """
+        Whether the solve has ended.
+        """
+        return self.thread.ident is not None and not self.thread.is_alive()
+
+    def Result(self, timeout: float = None) -> dict[int, dict[str, any]]:
+        """
+        Waits for the solve to end, at most timeout seconds, and returns the
+        result of optimize, or None if still running. Raises the error of
+        optimize, if any.
+        """
+        self.thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
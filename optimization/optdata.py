@@ -7,8 +7,11 @@ suitable for optimization.
 
 """
 
+import os
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
 
 
 def all_in(list_of_lists: list[list]) -> np.ndarray:
@@ -66,41 +69,492 @@ def ExtractOptimizationDataFromTravelDistanceMatrix(
     return result_dict
 
 
+def TravelDistanceBatches(
+    travel_dist,
+    columns: list[str],
+    max_distance: float,
+    batch_size: int = 1_000_000
+):
+    """
+    Yields the columns of the rows of a long-format travel distance table
+    within max_distance, as numpy arrays by column name, one batch at a time.
+
+    Args:
+        travel_dist: A pd.DataFrame, which is a single batch, or a
+            pyarrow.Table or the path of a Parquet (or, for the suffixes
+            .arrow, .feather and .ipc, Arrow) file or directory, read in
+            batches so that it does not need to fit in memory.
+        columns (list[str]): The columns to read, the last one being the
+            distance.
+        max_distance (float): Rows farther away are not read.
+        batch_size (int, optional): Rows per batch. Defaults to 1_000_000.
+    """
+    col_distance = columns[-1]
+    if isinstance(travel_dist, pd.DataFrame):
+        within = travel_dist[col_distance].to_numpy() <= max_distance
+        yield {c: travel_dist[c].to_numpy()[within] for c in columns}
+        return
+
+    # pyarrow is only needed to read Arrow and Parquet data
+    import pyarrow.dataset as ds
+    if isinstance(travel_dist, (str, os.PathLike)):
+        arrow = str(travel_dist).endswith(('.arrow', '.feather', '.ipc'))
+        travel_dist = ds.dataset(travel_dist,
+                                 format='ipc' if arrow else 'parquet')
+    else:
+        travel_dist = ds.dataset(travel_dist)
+    for batch in travel_dist.to_batches(
+            columns=columns,
+            filter=ds.field(col_distance) <= max_distance,
+            batch_size=batch_size):
+        yield {c: batch.column(c).to_numpy(zero_copy_only=False)
+               for c in columns}
+
+
+def ExtractCoverageMatricesFromTravelDistances(
+    travel_dist,
+    dist_thresholds: list[float],
+    col_distance: str = 'distance',
+    col_facility_id: str = 'fac_id',
+    col_pop_id: str = 'pop_id',
+    nof_households: int = None,
+    batch_size: int = 1_000_000
+) -> tuple[np.ndarray, dict[float, sparse.csc_matrix]]:
+    """
+    Extracts the coverage matrices of many distance thresholds at once from
+    a travel distance table, see
+    ExtractOptimizationDataFromTravelDistanceMatrix for a single threshold.
+
+    The table is read once, in batches, keeping for each row only the index
+    of the smallest threshold it is within. These are sorted once by
+    facility and distance, after which searchsorted gives, per facility and
+    threshold, the cut point of the households within the threshold. The
+    matrices are nested: each one has the entries of the smaller thresholds.
+
+    Args:
+        travel_dist: The travel distance table, as a pd.DataFrame or, when
+            larger than memory, as a pyarrow.Table or the path of a Parquet
+            or Arrow file, see TravelDistanceBatches.
+        dist_thresholds (list[float]): The maximum distances allowed for
+            population association.
+        col_distance (str, optional): The column name for distance values.
+            Defaults to 'distance'.
+        col_facility_id (str, optional): The column name for facility IDs.
+            Defaults to 'fac_id'.
+        col_pop_id (str, optional): The column name for population IDs,
+            which are the row indices. Defaults to 'pop_id'.
+        nof_households (int, optional): The number of rows, by default one
+            more than the largest population ID within reach.
+        batch_size (int, optional): Rows read per batch. Defaults to
+            1_000_000.
+
+    Returns:
+        J (np.ndarray): The sorted facility IDs, of the columns.
+        A (dict[float, sparse.csc_matrix]): Per threshold the coverage matrix,
+            A[t][i, c] is 1 if household i is within t of facility J[c].
+    """
+    thresholds = np.unique(np.asarray(dist_thresholds, dtype=float))
+    nof_levels = len(thresholds)
+    facilities, households, levels = [], [], []
+    for batch in TravelDistanceBatches(
+            travel_dist, [col_facility_id, col_pop_id, col_distance],
+            thresholds[-1], batch_size):
+        facilities.append(batch[col_facility_id])
+        households.append(batch[col_pop_id].astype(np.int64))
+        # the smallest threshold the household is within
+        levels.append(np.searchsorted(thresholds, batch[col_distance])
+                      .astype(np.min_scalar_type(nof_levels)))
+    if not facilities:
+        facilities, households, levels = [np.empty(0)], \
+            [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.uint8)]
+    J, facility = np.unique(np.concatenate(facilities), return_inverse=True)
+    household, level = np.concatenate(households), np.concatenate(levels)
+    del facilities, households, levels
+
+    order = np.lexsort((level, facility))
+    household, level = household[order], level[order]
+    key = facility[order].astype(np.int64) * nof_levels + level
+    del order, facility
+
+    # cuts[c, k] ends the households of J[c] within thresholds[k]
+    starts = np.searchsorted(key, np.arange(len(J)) * nof_levels)
+    cuts = np.searchsorted(
+        key, np.arange(len(J) * nof_levels).reshape(len(J), nof_levels),
+        side='right')
+    if nof_households is None:
+        nof_households = household.max(initial=-1) + 1
+
+    A = dict()
+    for k, threshold in enumerate(thresholds):
+        indptr = np.concatenate([[0], np.cumsum(cuts[:, k] - starts)])
+        indices = household[level <= k]
+        A[threshold] = sparse.csc_matrix(
+            (np.ones(len(indices), dtype=np.int8), indices, indptr),
+            shape=(nof_households, len(J)))
+        # the same pair may be listed more than once
+        A[threshold].sum_duplicates()
+        A[threshold].data[:] = 1
+    return J, A
+
+
 def CreateIndexMapping(
     all_facs: dict,
     household: list,
-    covered: set = set()
+    covered: set = set(),
+    as_sparse: bool = False
 ) -> tuple[np.array, np.array, dict, dict]:
     """
     CreateIndexMapping creates a mapping between the indices of the households
     and the facilities.
 
+    The pairs of all_facs are laid out once as a sparse matrix, and its
+    conversion to rows gives IJ, in time linear in the number of pairs.
+
     Parameters:
     all_facs (dict): A dictionary of facilities and their associated indices.
     household (list): A list of households.
     covered (set): A set of indices that are already covered.
+    as_sparse (bool): Whether to return IJ and JI as sparse matrices instead
+        of dicts, by default False.
 
     Returns:
     I (np.array): An array of indices of households.
     J (np.array): An array of indices of facilities.
+    IJ (dict): A dictionary of households to the facilities that they reach,
+        or, if as_sparse, the sparse.csr_matrix with IJ[i, c] = 1 if
+        household i reaches facility J[c].
+    JI (dict): A dictionary of facilities to the households in catchment area,
+        or, if as_sparse, the same matrix as a sparse.csc_matrix.
+    """
+    nof_households = len(household)
+    is_covered = np.zeros(nof_households, dtype=bool)
+    is_covered[np.fromiter(covered, dtype=np.int64)] = True
+
+    facilities = np.array(sorted(all_facs.keys()))
+    reach = [np.asarray(all_facs[j]) for j in facilities]
+    counts = np.fromiter((len(i) for i in reach), dtype=np.int64,
+                         count=len(reach))
+    households = np.concatenate(reach) if counts.sum() else np.empty(0)
+    if not np.issubdtype(households.dtype, np.integer):
+        # empty lists are float
+        households = households.astype(np.int64)
+    columns = np.repeat(np.arange(len(facilities)), counts)
+    in_range = (households >= 0) & (households < nof_households)
+    not_covered = ~is_covered[np.where(in_range, households, 0)] | ~in_range
+
+    # JI keeps the order of all_facs[j], and may name unknown households
+    ends = np.cumsum(np.bincount(columns[not_covered],
+                                 minlength=len(facilities)))
+    JI = {j: i for j, i in zip(facilities,
+                               np.split(households[not_covered], ends[:-1]))
+          if len(i)}
+
+    # IJ, the rows of the coverage matrix of the households in range
+    keep = not_covered & in_range
+    A = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.int8),
+         (households[keep], columns[keep])),
+        shape=(nof_households, len(facilities)))
+    A.sum_duplicates()
+    A.data[:] = 1
+    I = np.flatnonzero(A.getnnz(axis=1))  # noqa: E741
+    reached = np.flatnonzero(A.getnnz(axis=0))
+    J = facilities[reached]
+    if as_sparse:
+        A = A[:, reached]
+        return I, J, A, A.tocsc()
+    IJ = {i: facilities[A.indices[A.indptr[i]:A.indptr[i + 1]]] for i in I}
+    return I, J, IJ, JI
+
+
+def AggregateHouseholds(
+    w: list,
+    I: list,  # noqa: E741
+    IJ: dict
+) -> tuple[np.array, np.array, dict, np.array]:
+    """
+    Merges the households that reach exactly the same facilities, summing
+    their weights. A model on the merged households has the same optimal
+    value and solutions, with (many) fewer rows.
+
+    Parameters:
+    w (list): The weight of each household.
+    I (list): The households, only those in IJ are considered.
+    IJ (dict): A dictionary of households to the facilities that they reach,
+        as returned by CreateIndexMapping.
+
+    Returns:
+    w_merged (np.array): The weight of each merged household.
+    I_merged (np.array): The indices of the merged households.
+    IJ_merged (dict): A dictionary of merged households to facilities.
+    group (np.array): For each household in I (in IJ), the merged household.
+    """
+    I = np.array([i for i in I if i in IJ])  # noqa: E741
+    signatures = dict()
+    group = np.fromiter(
+        (signatures.setdefault(np.asarray(IJ[i]).tobytes(), len(signatures))
+         for i in I), dtype=np.int64, count=len(I))
+    w = np.asarray(w)
+    w_merged = np.bincount(group, weights=w[I], minlength=len(signatures))
+    if np.issubdtype(w.dtype, np.integer):
+        w_merged = np.round(w_merged).astype(w.dtype)
+    first = np.unique(group, return_index=True)[1]
+    IJ_merged = {k: IJ[I[r]] for k, r in enumerate(first)}
+    return w_merged, np.arange(len(signatures)), IJ_merged, group
+
+
+def ReduceCandidates(
+    IJ: dict,
+    JI: dict,
+    already_open: list = [],
+    block_size: int = 1000
+) -> tuple[dict, dict, pd.DataFrame]:
+    """
+    Removes the candidate facilities that cannot improve any solution: those
+    whose catchment area is a strict subset of another (dominated) and all
+    but one of those with the same catchment area (duplicate). Facilities
+    already open are never removed, but may dominate others. The optimal
+    coverage for each budget is unchanged.
+
+    Parameters:
     IJ (dict): A dictionary of households to the facilities that they reach.
     JI (dict): A dictionary of facilities to the households in catchment area.
+    already_open (list): The facilities already open.
+    block_size (int): The number of facilities compared at once, to bound
+        the memory of the sparse overlap matrix.
+
+    Returns:
+    IJ (dict): IJ without the removed facilities.
+    JI (dict): JI without the removed facilities.
+    audit (pd.DataFrame): One row per removed facility with the 'reason',
+        'duplicate' or 'dominated', the kept facility it is removed 'by' and
+        the 'size' of its catchment area.
     """
-    not_covered = np.setdiff1d(np.arange(len(household)),
-                               covered,
-                               assume_unique=True)
-    JI = {j: np.setdiff1d(i, covered, assume_unique=True)
-          for j, i in all_facs.items()}
-    JI = {j: i for j, i in JI.items() if len(i)}
-    IJ = {i: [] for i in not_covered}
-    for j, I in JI.items():
-        for i in I:
-            if i in IJ.keys():
-                IJ[i].append(j)
-    IJ = {i: np.unique(j) for i, j in IJ.items() if len(j)}
-    I = np.unique(list(IJ.keys()))  # noqa: E741
-    J = np.unique(np.concatenate(list(IJ.values())))
-    return I, J, IJ, JI
+    J = np.array(sorted(JI.keys()))
+    is_open = np.isin(J, already_open)
+    size = np.array([len(JI[j]) for j in J])
+    A = CoverageMatrix({c: JI[j] for c, j in enumerate(J)},
+                       1 + max((max(i, default=-1) for i in JI.values()),
+                               default=-1),
+                       len(J)).astype(np.int32)
+
+    removed = dict()
+    for first in range(0, len(J), block_size):
+        # overlap[c, k] is the number of households shared by c and k
+        overlap = (A[:, first:first+block_size].T @ A).tocoo()
+        c, k = overlap.row + first, overlap.col
+        contained = (overlap.data == size[c]) & (c != k)
+        for c, k in zip(c[contained], k[contained]):
+            if is_open[c]:
+                continue
+            if size[k] > size[c]:
+                reason = 'dominated'
+            elif is_open[k] or k < c:
+                reason = 'duplicate'
+            else:
+                continue
+            # prefer the largest facility containing c, never dominated
+            if c not in removed or size[k] > removed[c][1]:
+                removed[c] = (reason, size[k], k)
+
+    # the facility c is removed by may itself be removed, follow the chain
+    # (size grows, or stays with a lower index or an open facility) to the
+    # one kept, which dominates or duplicates c as well
+    by = dict()
+    for c in sorted(removed):
+        k = removed[c][2]
+        while k in removed:
+            k = removed[k][2]
+        by[c] = k
+    audit = pd.DataFrame(
+        [(J[c], 'dominated' if size[k] > size[c] else 'duplicate', J[k],
+          size[c]) for c, k in by.items()],
+        columns=['facility', 'reason', 'by', 'size'])
+    gone = audit.facility.to_numpy()
+    JI = {j: i for j, i in JI.items() if j not in set(gone)}
+    IJ = {i: np.asarray(js)[~np.isin(js, gone)] for i, js in IJ.items()}
+    return IJ, JI, audit
+
+
+def CoverageMatrix(
+    JI: dict,
+    nof_households: int,
+    nof_facilities: int = None
+) -> sparse.csc_matrix:
+    """
+    Builds the sparse coverage matrix of households by facilities.
+
+    Parameters:
+    JI (dict): A dictionary of facilities to the households in catchment area.
+    nof_households (int): The number of households (rows).
+    nof_facilities (int): The number of facilities (columns), by default one
+        more than the largest facility index in JI.
+
+    Returns:
+    A (sparse.csc_matrix): A[i, j] is 1 if household i is in the catchment
+        area of facility j, column j lists the households of JI[j].
+    """
+    if nof_facilities is None:
+        nof_facilities = max(JI.keys(), default=-1) + 1
+    J = np.array(sorted(JI.keys()), dtype=np.int64)
+    counts = np.zeros(nof_facilities + 1, dtype=np.int64)
+    counts[J + 1] = [len(JI[j]) for j in J]
+    indptr = np.cumsum(counts)
+    indices = (np.concatenate([np.asarray(JI[j], dtype=np.int64) for j in J])
+               if len(J) else np.empty(0, dtype=np.int64))
+    return sparse.csc_matrix(
+        (np.ones(len(indices), dtype=np.int8), indices, indptr),
+        shape=(nof_households, nof_facilities)
+    )
+
+
+def IndexedCoverageMatrix(
+    I: list,  # noqa: E741
+    J: list,
+    IJ: dict
+) -> sparse.csr_matrix:
+    """
+    Builds the sparse coverage matrix with one row per household in I and
+    one column per facility in J, in that order, as used by the solvers.
+
+    Parameters:
+    I (list): The households (keys of IJ).
+    J (list): The sorted facilities, containing all those in IJ[i] for i in I.
+    IJ (dict): A dictionary of households to the facilities in reach.
+
+    Returns:
+    A (sparse.csr_matrix): A[r, c] is 1 if J[c] is in IJ[I[r]].
+    """
+    J = np.asarray(J)
+    counts = np.fromiter((len(IJ[i]) for i in I), dtype=np.int64, count=len(I))
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    indices = (np.searchsorted(J, np.concatenate([np.asarray(IJ[i])
+                                                   for i in I]))
+               if indptr[-1] else np.empty(0, dtype=np.int64))
+    return sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int8), indices, indptr),
+        shape=(len(I), len(J))
+    )
+
+
+def PackCoverage(A: sparse.spmatrix) -> np.ndarray:
+    """
+    Packs the columns of a coverage matrix as bitsets of 64 households per
+    np.uint64 word, for fast unions and weighted counts of households.
+
+    Parameters:
+    A (sparse matrix): The coverage matrix of households by facilities, see
+        CoverageMatrix.
+
+    Returns:
+    bits (np.ndarray): bits[c, k] has bit b set if household 64 * k + b is
+        covered by facility c.
+    """
+    A = sparse.csc_matrix(A)
+    if not A.has_canonical_format:
+        A = A.copy()
+        A.sum_duplicates()
+    nof_words = (A.shape[0] + 63) // 64
+    bits = np.zeros((A.shape[1], nof_words), dtype=np.uint64)
+    columns = np.repeat(np.arange(A.shape[1]), np.diff(A.indptr))
+    # sorted, since the indices of each column are
+    key = columns * nof_words + (A.indices >> 6)
+    bit = np.left_shift(np.uint64(1), (A.indices & 63).astype(np.uint64))
+    if len(key):
+        first = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]]))
+        bits.ravel()[key[first]] = np.bitwise_or.reduceat(bit, first)
+    return bits
+
+
+def SolutionBits(bits: np.ndarray, solutions: list) -> np.ndarray:
+    """
+    OR-accumulates the bitsets of the facilities of each solution.
+
+    Parameters:
+    bits (np.ndarray): The packed coverage, see PackCoverage.
+    solutions (list): Lists of facilities (rows of bits).
+
+    Returns:
+    union (np.ndarray): union[s] is the bitset of the households covered by
+        solutions[s].
+    """
+    union = np.zeros((len(solutions), bits.shape[1]), dtype=np.uint64)
+    # one solution at a time, so that only its own rows are gathered
+    for s, solution in enumerate(solutions):
+        if len(solution):
+            np.bitwise_or.reduce(bits[np.asarray(solution, dtype=np.int64)],
+                                 axis=0, out=union[s])
+    return union
+
+
+# number of bits set in each 16 bits
+_popcount = np.array([bin(b).count('1') for b in range(2**16)],
+                     dtype=np.uint8)
+
+
+def WeightedPopcount(
+    words: np.ndarray,
+    w: np.ndarray = None,
+    max_bytes: int = 2**26
+) -> np.ndarray:
+    """
+    Sums the weights of the households set in each row of bitsets.
+
+    Parameters:
+    words (np.ndarray): Bitsets, one per row, see PackCoverage.
+    w (np.ndarray): The weight of each household, None counts them.
+    max_bytes (int): Rows are unpacked in blocks of about this many bytes.
+
+    Returns:
+    np.ndarray: The total weight (or number) of the households in each row.
+    """
+    words = np.ascontiguousarray(words, dtype='<u8')
+    if w is None:
+        return _popcount[words.view(np.uint16)].sum(axis=1, dtype=np.int64)
+    octets = words.view(np.uint8).reshape(len(words), -1)
+    w = np.asarray(w)
+    # a product of floats runs in BLAS, exact for integer weights below 2**53
+    weight = w.astype(np.float64)
+    rows = max(1, max_bytes // (8 * max(1, len(w))))
+    value = np.concatenate([
+        np.unpackbits(octets[r:r + rows], axis=1, count=len(w),
+                      bitorder='little').astype(np.float64) @ weight
+        for r in range(0, len(octets), rows)
+    ] or [np.zeros(0)])
+    return np.rint(value).astype(w.dtype) \
+        if np.issubdtype(w.dtype, np.integer) else value
+
+
+def CoverageComponents(
+    I: list,  # noqa: E741
+    J: list,
+    IJ: dict
+) -> list[tuple[np.array, np.array]]:
+    """
+    Splits the households and facilities in the connected components of the
+    bipartite graph of households and the facilities they reach. Components
+    can be optimized independently.
+
+    Parameters:
+    I (list): The households, only those in IJ are considered.
+    J (list): The facilities, only those reached by a household in I are
+        considered.
+    IJ (dict): A dictionary of households to the facilities that they reach.
+
+    Returns:
+    components (list[tuple[np.array, np.array]]): The households and the
+        facilities of each component, largest first.
+    """
+    I = np.array([i for i in I if i in IJ])  # noqa: E741
+    J = np.array(sorted(J))
+    A = IndexedCoverageMatrix(I, J, IJ)
+    graph = sparse.bmat([[None, A], [A.T, None]])
+    _, label = csgraph.connected_components(graph, directed=False)
+    household_label, facility_label = label[:len(I)], label[len(I):]
+    components = [(I[household_label == c],
+                   J[(facility_label == c) & (A.getnnz(axis=0) > 0)])
+                  for c in np.unique(household_label)]
+    return sorted(components, key=lambda c: -len(c[0]))
 
 
 def CheckIndexMapping(
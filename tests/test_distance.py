@@ -1,11 +1,21 @@
 import geopandas as gpd
+import networkx as nx
+import numpy as np
 import osmnx as ox
 import pandas as pd
 import pytest
 from geopandas.testing import assert_geoseries_equal
 from shapely.geometry import LineString, Point, Polygon
 
-from gpbp.distance import _get_poly_nx, calculate_isopolygons_graph
+from gpbp.distance import (
+    _get_poly_nx,
+    calculate_isopolygons_graph,
+    haversine_prefilter,
+    population_served,
+    prefilter_radius,
+)
+from gpbp.road_network import simplify_for_routing
+from gpbp.utils import group_population
 
 
 @pytest.fixture
@@ -128,3 +138,158 @@ class TestCalculateIsopolygonsGraph:
         isopolygons_ID_50 = isopolygons["ID_50"]
 
         assert isinstance(isopolygons_ID_50[0], Polygon)
+
+
+class TestPrefilterRadius:
+
+    def test_length(self):
+        assert prefilter_radius("length", 5000) == 5000
+
+    def test_travel_time(self):
+        # 60 km/h is one kilometer per minute
+        assert prefilter_radius("travel_time", 10, max_speed=60) == 10000
+
+    def test_travel_time_needs_speed(self):
+        with pytest.raises(Exception, match="maximum speed"):
+            prefilter_radius("travel_time", 10)
+
+
+class TestHaversinePrefilter:
+
+    def test_pairs_within_radius(self):
+        # One degree of latitude is about 111 km
+        pop_df = pd.DataFrame({"longitude": [0.0, 0.0, 0.0], "latitude": [0.0, 0.5, 2.0]})
+        fac_df = pd.DataFrame({"longitude": [0.0, 0.0], "latitude": [0.0, 10.0]})
+
+        fac_idx, pop_idx, dist = haversine_prefilter(pop_df, fac_df, radius=100000)
+
+        assert list(fac_idx) == [0, 0]
+        assert sorted(pop_idx) == [0, 1]
+        assert np.allclose(sorted(dist), [0, 55597.5], atol=1)
+
+    def test_empty_population(self):
+        pop_df = pd.DataFrame({"longitude": [], "latitude": []})
+        fac_df = pd.DataFrame({"longitude": [0.0], "latitude": [0.0]})
+
+        fac_idx, pop_idx, dist = haversine_prefilter(pop_df, fac_df, radius=1000)
+
+        assert len(fac_idx) == len(pop_idx) == len(dist) == 0
+
+
+class TestPopulationServedPrefilter:
+
+    @pytest.fixture
+    def pop_gdf(self) -> gpd.GeoDataFrame:
+        pop_df = pd.DataFrame(
+            {
+                "longitude": [-122.2314, -122.2318, -122.2325, -122.2500],
+                "latitude": [37.7687, 37.7690, 37.7685, 37.7687],
+                "population": [1, 2, 3, 4],
+            }
+        )
+        return group_population(pop_df, 5)
+
+    @pytest.fixture
+    def fac_gdf(self) -> gpd.GeoDataFrame:
+        lon, lat = [-122.231243, -122.2325405], [37.7687576, 37.7687]
+        return gpd.GeoDataFrame(
+            {"ID": [0, 1], "longitude": lon, "latitude": lat},
+            geometry=gpd.points_from_xy(lon, lat),
+        )
+
+    def test_same_result_as_without_prefilter(self, pop_gdf, fac_gdf):
+        road_network = ox.load_graphml("tests/test_data/walk_network_MAIN.graphml")
+        args = (pop_gdf, fac_gdf, "facilities", "length", [50, 100], "walking", "osm")
+
+        with_prefilter = population_served(*args, road_network=road_network)
+        without_prefilter = population_served(
+            *args, road_network=road_network, prefilter=False
+        )
+
+        sort_lists = lambda df: df.map(lambda x: sorted(x) if isinstance(x, list) else x)
+        pd.testing.assert_frame_equal(
+            sort_lists(with_prefilter), sort_lists(without_prefilter)
+        )
+        # the household at -122.25 is more than 1 km away from both facilities
+        assert with_prefilter.attrs["pruning_ratio"] == 0.25
+
+    def test_large_buffer(self, pop_gdf, fac_gdf):
+        road_network = ox.load_graphml("tests/test_data/walk_network_MAIN.graphml")
+        args = (pop_gdf, fac_gdf, "facilities", "length", [50], "walking", "osm")
+
+        # node buffers of about 2.2 km reach the household at -122.25
+        with_prefilter = population_served(
+            *args, road_network=road_network, node_buff=0.02
+        )
+        without_prefilter = population_served(
+            *args, road_network=road_network, prefilter=False, node_buff=0.02
+        )
+
+        assert 0 in without_prefilter.loc[0, "ID_50"]
+        assert sorted(with_prefilter.loc[0, "ID_50"]) == sorted(
+            without_prefilter.loc[0, "ID_50"]
+        )
+
+    def test_facility_far_from_network(self, pop_gdf):
+        # the facility snaps to a network node about 2.7 km away
+        lon, lat = [-122.2], [37.7687576]
+        fac_gdf = gpd.GeoDataFrame(
+            {"ID": [0], "longitude": lon, "latitude": lat},
+            geometry=gpd.points_from_xy(lon, lat),
+        )
+        road_network = ox.load_graphml("tests/test_data/walk_network_MAIN.graphml")
+        args = (pop_gdf, fac_gdf, "facilities", "length", [50], "walking", "osm")
+
+        with_prefilter = population_served(*args, road_network=road_network)
+        without_prefilter = population_served(
+            *args, road_network=road_network, prefilter=False
+        )
+
+        assert len(without_prefilter.loc[0, "ID_50"]) > 0
+        assert sorted(with_prefilter.loc[0, "ID_50"]) == sorted(
+            without_prefilter.loc[0, "ID_50"]
+        )
+
+
+class TestPopulationServedSimplified:
+    @pytest.fixture
+    def road_network(self) -> nx.MultiDiGraph:
+        """Two-way road 0 - 1 - 2 - 3 - 4 with a one-way branch 2 -> 5 -> 6"""
+        road_network = nx.MultiDiGraph(crs="EPSG:4326")
+        for node in range(5):
+            road_network.add_node(node, x=-122.23 + 0.001 * node, y=37.77)
+        road_network.add_node(5, x=-122.228, y=37.771)
+        road_network.add_node(6, x=-122.228, y=37.772)
+        for u, v in [(0, 1), (1, 2), (2, 3), (3, 4)]:
+            road_network.add_edge(u, v, length=100.0)
+            road_network.add_edge(v, u, length=100.0)
+        road_network.add_edge(2, 5, length=100.0)
+        road_network.add_edge(5, 6, length=100.0)
+        return road_network
+
+    def test_same_result_as_original(self, road_network):
+        pop_df = pd.DataFrame(
+            {
+                "longitude": np.linspace(-122.2305, -122.2255, 20),
+                "latitude": np.full(20, 37.7701),
+                "population": np.ones(20),
+            }
+        )
+        pop_gdf = group_population(pop_df, 5)
+        # next to the contracted nodes 1 and 5, and to the kept node 4
+        lon, lat = [-122.229, -122.228, -122.226], [37.7699, 37.771, 37.7699]
+        fac_gdf = gpd.GeoDataFrame(
+            {"ID": [0, 1, 2], "longitude": lon, "latitude": lat},
+            geometry=gpd.points_from_xy(lon, lat),
+        )
+        args = (pop_gdf, fac_gdf, "facilities", "length", [150, 250], "walking", "osm")
+        simplified = simplify_for_routing(road_network, fragments="keep")
+
+        assert len(simplified) < len(road_network)
+        sort_lists = lambda df: df.map(
+            lambda x: sorted(x) if isinstance(x, list) else x
+        )
+        pd.testing.assert_frame_equal(
+            sort_lists(population_served(*args, road_network=simplified)),
+            sort_lists(population_served(*args, road_network=road_network)),
+        )
@@ -191,6 +191,49 @@ def test_get_road_network(mocker, adm_area, mock_graph, network_type, default_sp
         assert round(data["travel_time"], 2) == round(expected_travel_time, 2)
 
 
+@pytest.fixture
+def unsimplified_roads():
+    """Two-way residential road 0 - 1 - 2 continued by a footway 2 - 3"""
+    road_network = nx.MultiDiGraph(crs="EPSG:4326")
+    for node in range(4):
+        road_network.add_node(node, x=125.5 + 0.001 * node, y=-8.5)
+    for u, v, highway, osmid in [
+        (0, 1, "residential", 1),
+        (1, 2, "residential", 1),
+        (2, 3, "footway", 2),
+    ]:
+        for a, b, reverse in [(u, v, False), (v, u, True)]:
+            road_network.add_edge(
+                a, b, osmid=osmid, highway=highway, oneway=False,
+                reversed=reverse, length=100.0,
+            )
+    return road_network
+
+
+def test_get_road_networks(mocker, adm_area, unsimplified_roads):
+    graph_from_polygon = mocker.patch(
+        "gpbp.layers.ox.graph_from_polygon", return_value=unsimplified_roads
+    )
+
+    adm_area.get_road_networks(network_types=["driving", "walking"])
+
+    graph_from_polygon.assert_called_once_with(
+        adm_area.geometry, network_type="all", simplify=False, retain_all=True
+    )
+    assert set(adm_area.road_networks) == {"driving", "walking"}
+    # the residential road is simplified on its own, not with the footway
+    assert set(adm_area.road_networks["driving"].edges()) == {(0, 2), (2, 0)}
+    assert set(adm_area.road_networks["walking"].edges()) == {(0, 3), (3, 0)}
+    for network_type, default_speed in [["driving", 50], ["walking", 4]]:
+        for _, _, data in adm_area.road_networks[network_type].edges(data=True):
+            assert data["speed_kph"] == default_speed
+
+
+def test_get_road_networks_invalid_type(adm_area):
+    with pytest.raises(Exception, match="Invalid network type"):
+        adm_area.get_road_networks(network_types=["driving", "flying"])
+
+
 class TestAdmAreaPrepareOptimizationData:
     @pytest.fixture
     def adm_area_with_population_and_facilities(self, adm_area, population_dataframe):
@@ -0,0 +1,263 @@
+import geopandas as gpd
+import geopy.distance
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pytest
+from shapely.geometry import LineString
+
+from gpbp.road_network import (
+    add_travel_times,
+    build_road_network,
+    filter_road_network,
+    get_length_edges,
+    load_road_network,
+    save_road_network,
+    simplify_for_routing,
+)
+
+
+@pytest.fixture
+def road_geometries() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {
+            "highway": ["primary", "residential", "residential"],
+            "maxspeed": ["80", None, "unknown"],
+        },
+        geometry=[
+            LineString([(125.5, -8.5), (125.505, -8.502), (125.51, -8.5)]),
+            LineString([(125.51, -8.5), (125.52, -8.51)]),
+            # end point equal to the first point after rounding
+            LineString([(125.52, -8.51), (125.500001, -8.500001)]),
+        ],
+    )
+
+
+class TestGetLengthEdges:
+    def test_geodesic_matches_geopy(self):
+        from_x, from_y, to_x, to_y = (
+            [125.5, 0.0],
+            [-8.5, 0.0],
+            [125.6, 1.0],
+            [-8.4, 1.0],
+        )
+
+        lengths = get_length_edges(from_x, from_y, to_x, to_y, method="geodesic")
+
+        expected = [
+            geopy.distance.geodesic((fy, fx), (ty, tx)).meters
+            for fx, fy, tx, ty in zip(from_x, from_y, to_x, to_y)
+        ]
+        assert np.allclose(lengths, expected, rtol=1e-9)
+
+    def test_haversine_close_to_geodesic(self):
+        args = ([125.5], [-8.5], [125.6], [-8.4])
+
+        haversine = get_length_edges(*args, method="haversine")
+        geodesic = get_length_edges(*args, method="geodesic")
+
+        assert np.allclose(haversine, geodesic, rtol=1e-2)
+
+    def test_invalid_method(self):
+        with pytest.raises(Exception, match="Invalid length method"):
+            get_length_edges([0], [0], [1], [1], method="manhattan")
+
+
+class TestBuildRoadNetwork:
+    def test_nodes_are_deduplicated(self, road_geometries):
+        network = build_road_network(road_geometries, default_speed=50)
+
+        assert isinstance(network, nx.MultiDiGraph)
+        assert sorted(network.nodes) == [0, 1, 2]
+        assert network.nodes[0] == {"x": 125.5, "y": -8.5}
+        assert list(network.edges(keys=True)) == [(0, 1, 0), (1, 2, 0), (2, 0, 0)]
+
+    def test_speeds(self, road_geometries):
+        network = build_road_network(
+            road_geometries, road_speeds={"residential": 30}, default_speed=50
+        )
+
+        speeds = [data["maxspeed"] for _, _, data in network.edges(data=True)]
+        assert speeds == [80, 30, 30]
+        for _, _, data in network.edges(data=True):
+            assert data["travel_time"] == pytest.approx(
+                data["length"] / (data["maxspeed"] * 1000 / 60)
+            )
+
+    def test_default_speed(self, road_geometries):
+        network = build_road_network(road_geometries, default_speed=50)
+
+        speeds = [data["maxspeed"] for _, _, data in network.edges(data=True)]
+        assert speeds == [80, 50, 50]
+
+
+class TestSaveLoadRoadNetwork:
+    @pytest.fixture
+    def road_network(self) -> nx.MultiDiGraph:
+        return ox.load_graphml("tests/test_data/drive_network_MAIN.graphml")
+
+    def test_round_trip(self, road_network, tmp_path):
+        save_road_network(road_network, tmp_path)
+        loaded = load_road_network(tmp_path)
+
+        assert list(loaded.nodes(data=True)) == [
+            (node, {"x": data["x"], "y": data["y"]})
+            for node, data in road_network.nodes(data=True)
+        ]
+        assert set(loaded.edges(keys=True)) == set(road_network.edges(keys=True))
+        for u, v, k, data in road_network.edges(keys=True, data=True):
+            assert loaded.edges[u, v, k]["length"] == data["length"]
+            if "geometry" in data:
+                assert loaded.edges[u, v, k]["geometry"].equals(data["geometry"])
+            else:
+                assert "geometry" not in loaded.edges[u, v, k]
+
+    def test_arrays_are_memory_mapped(self, road_network, tmp_path):
+        save_road_network(road_network, tmp_path, geometry=False)
+        arrays = load_road_network(tmp_path, graph_type="arrays")
+
+        assert isinstance(arrays["indices"], np.memmap)
+        assert not arrays["indices"].flags.writeable
+        assert arrays["meta"]["weights"] == ["length"]
+        assert arrays["indptr"][-1] == road_network.number_of_edges()
+
+    def test_non_integer_node_ids(self, tmp_path):
+        road_network = nx.MultiDiGraph()
+        road_network.add_node("a", x=0.0, y=0.0)
+
+        with pytest.raises(Exception, match="integer node ids"):
+            save_road_network(road_network, tmp_path)
+
+
+class TestSimplifyForRouting:
+    @pytest.fixture
+    def chain(self) -> nx.MultiDiGraph:
+        """Two-way road 0 - 1 - 2 - 3 with a one-way spur 3 -> 4 -> 5 -> 3"""
+        road_network = nx.MultiDiGraph()
+        for node in range(6):
+            road_network.add_node(node, x=float(node), y=0.0)
+        for u, v in [(0, 1), (1, 2), (2, 3)]:
+            road_network.add_edge(u, v, length=10.0, travel_time=1.0)
+            road_network.add_edge(v, u, length=10.0, travel_time=1.0)
+        for u, v in [(3, 4), (4, 5), (5, 3)]:
+            road_network.add_edge(u, v, length=5.0, travel_time=0.5)
+        return road_network
+
+    def test_chains_are_contracted(self, chain):
+        simplified = simplify_for_routing(chain)
+
+        assert sorted(simplified.nodes) == [0, 3, 5]
+        assert simplified.graph["routing_preparation"] == {
+            "nodes_before": 6,
+            "nodes_after": 3,
+            "edges_before": 9,
+            "edges_after": 4,
+        }
+        data = simplified.get_edge_data(0, 3)[0]
+        assert data["length"] == 30.0
+        assert data["travel_time"] == 3.0
+        assert list(data["geometry"].coords) == [(0, 0), (1, 0), (2, 0), (3, 0)]
+        # the one-way loop keeps one node to avoid a self-loop
+        assert simplified.get_edge_data(3, 5)[0]["length"] == 10.0
+
+    def test_largest_component(self, chain):
+        chain.add_edge(0, 6, length=1.0, travel_time=0.1)
+        chain.nodes[6].update(x=-1.0, y=0.0)
+
+        simplified = simplify_for_routing(chain, fragments="largest")
+
+        assert 6 not in simplified.nodes
+
+    def test_snap_island(self, chain):
+        chain.add_node(7, x=0.0, y=0.001)
+        chain.add_node(8, x=0.0, y=0.002)
+        chain.add_edge(7, 8, length=111.0, travel_time=1.0)
+        chain.add_edge(8, 7, length=111.0, travel_time=1.0)
+
+        simplified = simplify_for_routing(chain, fragments="snap", snap_speed=6)
+
+        assert nx.is_strongly_connected(simplified)
+        # 111 meters to 7, snapped to 0 at 111 meters, then 30 meters to 3
+        assert nx.shortest_path_length(simplified, 8, 3, weight="length") == (
+            pytest.approx(252.2, abs=0.5)
+        )
+
+    def test_distances_are_unchanged(self):
+        road_network = ox.load_graphml("tests/test_data/walk_network_MAIN.graphml")
+
+        simplified = simplify_for_routing(road_network, fragments="keep")
+
+        assert len(simplified) < len(road_network)
+        for source in simplified.nodes:
+            before = nx.single_source_dijkstra_path_length(
+                road_network, source, weight="length"
+            )
+            after = nx.single_source_dijkstra_path_length(
+                simplified, source, weight="length"
+            )
+            for target, distance in after.items():
+                assert distance == pytest.approx(before[target])
+
+
+class TestFilterRoadNetwork:
+    @pytest.fixture
+    def all_roads(self) -> nx.MultiDiGraph:
+        road_network = nx.MultiDiGraph()
+        for node in range(5):
+            road_network.add_node(node, x=float(node), y=0.0)
+        road_network.add_edge(0, 1, highway="motorway", oneway=True, length=10.0)
+        road_network.add_edge(1, 2, highway="footway", oneway=False, length=10.0)
+        road_network.add_edge(2, 1, highway="footway", oneway=False, length=10.0)
+        road_network.add_edge(
+            2, 3, highway=["residential", "primary"], oneway=True, length=10.0
+        )
+        road_network.add_edge(3, 4, highway="cycleway", bicycle="yes", length=10.0)
+        road_network.add_edge(4, 3, highway="service", access="private", length=1.0)
+        return road_network
+
+    @pytest.mark.parametrize(
+        ["network_type", "expected_edges"],
+        [
+            ["driving", [(0, 1, 0), (2, 3, 0)]],
+            ["walking", [(1, 2, 0), (2, 1, 0), (2, 3, 0), (3, 2, 0)]],
+            ["cycling", [(2, 3, 0), (3, 4, 0)]],
+        ],
+    )
+    def test_edges_per_mode(self, all_roads, network_type, expected_edges):
+        road_network = filter_road_network(all_roads, network_type)
+
+        assert sorted(road_network.edges(keys=True)) == expected_edges
+
+    def test_walking_ignores_oneway(self, all_roads):
+        road_network = filter_road_network(all_roads, "walking")
+
+        reverse = road_network.edges[3, 2, 0]
+        assert reverse["reversed"] is True
+        assert reverse["oneway"] is False
+        assert reverse["highway"] == ["residential", "primary"]
+
+    @pytest.mark.parametrize("network_type", ["driving", "walking", "cycling"])
+    def test_after_save_and_load(self, all_roads, network_type, tmp_path):
+        save_road_network(all_roads, tmp_path)
+        loaded = load_road_network(tmp_path)
+
+        assert loaded.edges[2, 3, 0]["highway"] == ["residential", "primary"]
+        assert loaded.edges[0, 1, 0]["oneway"] is True
+        expected = filter_road_network(all_roads, network_type)
+        assert sorted(filter_road_network(loaded, network_type).edges(keys=True)) == (
+            sorted(expected.edges(keys=True))
+        )
+
+    def test_invalid_network_type(self, all_roads):
+        with pytest.raises(Exception, match="Invalid network type"):
+            filter_road_network(all_roads, "flying")
+
+
+def test_add_travel_times():
+    road_network = ox.load_graphml("tests/test_data/walk_network_MAIN.graphml")
+
+    road_network = add_travel_times(road_network, default_speed=6)
+
+    for _, _, data in road_network.edges(data=True):
+        assert data["speed_kph"] == 6
+        assert data["travel_time"] == round(data["length"] / 100, 2)